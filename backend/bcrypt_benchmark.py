@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Pick a bcrypt cost for password hashing on this machine.
+
+Times bcrypt at increasing costs and recommends the highest one whose median hash
+time stays within the target latency. Set the result as BCRYPT_ROUNDS for the API;
+existing hashes are upgraded to it as users log in.
+
+Usage:
+    python bcrypt_benchmark.py [--target-ms 250] [--samples 5]
+"""
+
+import argparse
+import statistics
+import time
+
+from passlib.hash import bcrypt
+
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+def time_rounds(rounds: int, samples: int) -> float:
+    """Median milliseconds to hash one password at the given cost"""
+    hasher = bcrypt.using(rounds=rounds)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        hasher.hash("benchmark-password")
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def pick_rounds(target_ms: float, samples: int) -> int:
+    chosen = MIN_ROUNDS
+    for rounds in range(MIN_ROUNDS, MAX_ROUNDS + 1):
+        median_ms = time_rounds(rounds, samples)
+        within_target = median_ms <= target_ms
+        print(f"   rounds={rounds:2d}  {median_ms:8.1f} ms  {'✅' if within_target else '❌'}")
+        if not within_target:
+            break
+        chosen = rounds
+    return chosen
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target-ms", type=float, default=250)
+    parser.add_argument("--samples", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"⏱️  Timing bcrypt (target {args.target_ms:.0f} ms per hash)...")
+    rounds = pick_rounds(args.target_ms, args.samples)
+    print(f"\n🔐 Recommended: BCRYPT_ROUNDS={rounds}")
@@ -0,0 +1,94 @@
+"""
+Image processing for uploads.
+
+Everything here is CPU-bound PIL work that the API runs in worker processes, so this
+module must stay importable on its own (it never imports server.py).
+"""
+
+from io import BytesIO
+from typing import BinaryIO, Dict, List, Tuple
+
+from PIL import Image, ImageOps, features
+
+WEBP_SUPPORTED = features.check("webp")
+
+# Formats accepted for upload; MPO is how PIL opens many phone camera JPEGs
+UPLOAD_FORMATS = {"JPEG", "MPO", "PNG", "WEBP", "GIF"}
+
+class InvalidImage(ValueError):
+    """The uploaded bytes could not be decoded as an image"""
+
+class ImageTooLarge(InvalidImage):
+    """The image's dimensions exceed what we are willing to decode"""
+
+def probe_image(fileobj: BinaryIO, max_pixels: int) -> Tuple[str, Tuple[int, int]]:
+    """Format and size of an image read from its header alone, before any pixel is decoded"""
+    try:
+        with Image.open(fileobj) as image:
+            image_format, size = image.format, image.size
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise InvalidImage(str(e)) from None
+    finally:
+        fileobj.seek(0)
+    
+    if image_format not in UPLOAD_FORMATS:
+        raise InvalidImage(f"Unsupported image format {image_format}")
+    if size[0] * size[1] > max_pixels:
+        raise ImageTooLarge(f"Image of {size[0]}x{size[1]} pixels exceeds the {max_pixels // 1_000_000} megapixel limit")
+    return image_format, size
+
+def flatten_alpha(image: Image.Image) -> Image.Image:
+    """RGB copy of an image with any transparency composited onto white"""
+    if image.mode == 'P':
+        image = image.convert('RGBA')
+    if image.mode in ('RGBA', 'LA'):
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    return image.convert('RGB')
+
+def encode_image(image: Image.Image, quality: int, image_format: str = 'JPEG') -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, quality=quality)
+    return buffer.getvalue()
+
+def process_image(data: bytes, max_size: Tuple[int, int], quality: int = 85, crop: bool = False) -> bytes:
+    """Decode an upload and re-encode it as a JPEG no larger than max_size.
+
+    With crop the image is center-cropped to exactly max_size (avatars); otherwise it
+    keeps its aspect ratio and only shrinks.
+    """
+    try:
+        image = Image.open(BytesIO(data))
+        # JPEG only: decode at the smallest 1/2, 1/4 or 1/8 scale still covering the output,
+        # either way round since EXIF rotation may swap the sides
+        longest_side = max(max_size)
+        image.draft('RGB', (longest_side, longest_side))
+        image = ImageOps.exif_transpose(image)
+        if crop:
+            image = ImageOps.fit(image, max_size, Image.LANCZOS)
+        else:
+            image.thumbnail(max_size, Image.LANCZOS)
+        return encode_image(flatten_alpha(image), quality)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise InvalidImage(str(e)) from None
+
+def render_renditions(data: bytes, widths: List[int], image_format: str = 'JPEG', quality: int = 82) -> Dict[int, bytes]:
+    """Encode a stored image at several widths from a single decode.
+
+    The source is draft-decoded just large enough for the widest rendition, then each
+    narrower one is downscaled from the previous. Images are never enlarged.
+    """
+    try:
+        image = Image.open(BytesIO(data))
+        image.draft('RGB', (max(widths), 1))
+        image = flatten_alpha(image)
+        
+        renditions = {}
+        for width in sorted(set(widths), reverse=True):
+            if image.width > width:
+                image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            renditions[width] = encode_image(image, quality, image_format)
+        return renditions
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise InvalidImage(str(e)) from None
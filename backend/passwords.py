@@ -0,0 +1,15 @@
+"""
+Password hashing for bulk work.
+
+Runs in worker processes, so like imaging.py this module must stay importable on its own
+(it never imports server.py).
+"""
+
+from typing import List
+
+from passlib.hash import bcrypt
+
+def hash_password_batch(passwords: List[str], rounds: int) -> List[str]:
+    """Hash a chunk of passwords at the given bcrypt cost"""
+    hasher = bcrypt.using(rounds=rounds)
+    return [hasher.hash(password) for password in passwords]
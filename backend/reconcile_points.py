@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Reconcile user_stats.total_points / current_points / level with the records that award points.
+
+Streams users, their stats and their approved actions, completed missions and perfect
+quizzes in large batches, computes the expected totals with pandas group-bys and repairs
+every mismatch with bulk_write.
+
+Usage:
+    python reconcile_points.py [--dry-run] [--batch-size 50000]
+"""
+
+import argparse
+import asyncio
+import time
+
+import numpy as np
+import pandas as pd
+from pymongo import UpdateOne
+
+from server import db, client, USER_LEVELS
+
+async def load_frame(collection, query: dict, fields: dict, batch_size: int) -> pd.DataFrame:
+    """Stream a projection of a collection into a DataFrame, one batch at a time"""
+    cursor = collection.find(query, {"_id": 0, **fields}, batch_size=batch_size)
+    frames = []
+    while True:
+        batch = await cursor.to_list(length=batch_size)
+        if not batch:
+            break
+        frames.append(pd.DataFrame.from_records(batch, columns=list(fields)))
+    if not frames:
+        return pd.DataFrame(columns=list(fields))
+    return pd.concat(frames, ignore_index=True)
+
+async def load_awards(batch_size: int) -> pd.DataFrame:
+    """All point awards as user_id / points / awarded_at rows"""
+    actions, missions, quizzes = await asyncio.gather(
+        load_frame(
+            db.user_actions,
+            {"verification_status": "approved"},
+            {"user_id": 1, "points_earned": 1, "verified_at": 1, "created_at": 1},
+            batch_size
+        ),
+        load_frame(
+            db.user_missions,
+            {},
+            {"user_id": 1, "points_earned": 1, "completed_at": 1},
+            batch_size
+        ),
+        load_frame(
+            db.quiz_completions,
+            {"points_earned": {"$gt": 0}},
+            {"user_id": 1, "points_earned": 1, "completed_at": 1},
+            batch_size
+        )
+    )
+
+    actions["awarded_at"] = actions["verified_at"].fillna(actions["created_at"])
+    missions["awarded_at"] = missions["completed_at"]
+    quizzes["awarded_at"] = quizzes["completed_at"]
+
+    columns = ["user_id", "points_earned", "awarded_at"]
+    awards = pd.concat([actions[columns], missions[columns], quizzes[columns]], ignore_index=True)
+    awards["points_earned"] = awards["points_earned"].astype("int64")
+    awards["awarded_at"] = pd.to_datetime(awards["awarded_at"])
+    return awards
+
+def expected_levels(total_points: pd.Series) -> np.ndarray:
+    return np.select(
+        [total_points >= threshold for threshold, _ in USER_LEVELS],
+        [level for _, level in USER_LEVELS],
+        default=USER_LEVELS[-1][1]
+    )
+
+def find_mismatches(users: pd.DataFrame, awards: pd.DataFrame) -> pd.DataFrame:
+    """Users whose stored counters differ from what their awards add up to"""
+    users = users.copy()
+    users["last_reset"] = pd.to_datetime(users["last_reset"]).fillna(pd.Timestamp.min)
+
+    # current_points only counts awards made since the user's last reset
+    awards = awards.merge(users[["id", "last_reset"]], left_on="user_id", right_on="id", how="inner")
+    since_reset = awards[awards["awarded_at"] >= awards["last_reset"]]
+
+    total = awards.groupby("user_id")["points_earned"].sum()
+    current = since_reset.groupby("user_id")["points_earned"].sum()
+
+    users["expected_total"] = users["id"].map(total).fillna(0).astype("int64")
+    users["expected_current"] = users["id"].map(current).fillna(0).astype("int64")
+    users["expected_level"] = expected_levels(users["expected_total"])
+
+    for column in ["total_points", "current_points"]:
+        users[column] = users[column].fillna(0).astype("int64")
+
+    mismatched = (
+        (users["total_points"] != users["expected_total"])
+        | (users["current_points"] != users["expected_current"])
+        | (users["level"] != users["expected_level"])
+    )
+    return users[mismatched]
+
+async def apply_fixes(mismatches: pd.DataFrame, batch_size: int) -> int:
+    operations = [
+        UpdateOne(
+            {"user_id": row.id},
+            {"$set": {
+                "total_points": int(row.expected_total),
+                "current_points": int(row.expected_current),
+                "level": row.expected_level
+            }}
+        )
+        for row in mismatches.itertuples(index=False)
+    ]
+
+    modified = 0
+    for start in range(0, len(operations), batch_size):
+        result = await db.user_stats.bulk_write(operations[start:start + batch_size], ordered=False)
+        modified += result.modified_count
+    return modified
+
+async def reconcile(dry_run: bool, batch_size: int):
+    started = time.perf_counter()
+    print("🔎 Reconciling user points...")
+
+    users, stats, awards = await asyncio.gather(
+        load_frame(db.users, {}, {"id": 1, "username": 1, "last_reset": 1}, batch_size),
+        load_frame(
+            db.user_stats,
+            {},
+            {"user_id": 1, "total_points": 1, "current_points": 1, "level": 1},
+            batch_size
+        ),
+        load_awards(batch_size)
+    )
+    # Only users that have stats can be repaired; the API creates the rest on their first award
+    users = users.merge(stats, left_on="id", right_on="user_id", how="inner").drop(columns="user_id")
+    print(f"   Loaded {len(users)} users and {len(awards)} awards")
+
+    mismatches = find_mismatches(users, awards)
+    print(f"   Found {len(mismatches)} mismatched users")
+
+    for row in mismatches.head(20).itertuples(index=False):
+        print(
+            f"   - {row.username}: total {row.total_points} -> {row.expected_total}, "
+            f"current {row.current_points} -> {row.expected_current}, "
+            f"level {row.level} -> {row.expected_level}"
+        )
+    if len(mismatches) > 20:
+        print(f"   ... and {len(mismatches) - 20} more")
+
+    if not dry_run and len(mismatches):
+        modified = await apply_fixes(mismatches, batch_size)
+        print(f"✅ Repaired {modified} users")
+
+    print(f"   Done in {time.perf_counter() - started:.2f}s")
+    client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="only report mismatches")
+    parser.add_argument("--batch-size", type=int, default=50000)
+    args = parser.parse_args()
+
+    asyncio.run(reconcile(args.dry_run, args.batch_size))
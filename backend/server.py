@@ -1,25 +1,44 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Depends, Query
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Depends, Header, Query, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.requests import ClientDisconnect
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from gridfs.errors import NoFile
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, TypeAdapter, ValidationError
 from typing import List, Optional, Dict
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from array import array
 import uuid
+import json
 from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 from passlib.context import CryptContext
 import jwt
 import base64
-from io import BytesIO
-from PIL import Image
+import csv
+from io import StringIO
 import asyncio
+import hashlib
+import math
+import multiprocessing
+import random
+import re
+import time
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+from passwords import hash_password_batch
+from imaging import WEBP_SUPPORTED, ImageTooLarge, InvalidImage, probe_image, process_image, render_renditions
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -29,7 +48,9 @@ client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Pick the cost with bcrypt_benchmark.py; hashes with a different cost are upgraded on login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 security = HTTPBearer()
 JWT_SECRET = "desideri-di-puglia-secret-key"
 JWT_ALGORITHM = "HS256"
@@ -42,11 +63,39 @@ api_router = APIRouter(prefix="/api")
 
 # === EMAIL FUNCTIONS ===
 
-def generate_club_card_code() -> str:
-    """Generate unique DP-XXXX club card code"""
-    import random
-    code_number = random.randint(1000, 9999)
-    return f"DP-{code_number}"
+# Club card codes come from an atomic sequence in db.counters. Sequence numbers are
+# grouped into blocks by digit count, starting at 5 digits so they never collide
+# with the legacy random 4-digit codes, and scrambled within their block by an
+# affine permutation so consecutive members don't get consecutive codes.
+CLUB_CARD_COUNTER_ID = "club_card_code"
+CLUB_CARD_MIN_DIGITS = 5
+CLUB_CARD_MULTIPLIER = 7919  # coprime with every block size (9 * 10^k)
+CLUB_CARD_OFFSET = 4099
+
+def format_club_card_code(sequence: int) -> str:
+    """Map the n-th allocated sequence number (from 0) to its DP- code"""
+    digits = CLUB_CARD_MIN_DIGITS
+    block_size = 9 * 10 ** (digits - 1)
+    while sequence >= block_size:
+        sequence -= block_size
+        digits += 1
+        block_size = 9 * 10 ** (digits - 1)
+    scrambled = (sequence * CLUB_CARD_MULTIPLIER + CLUB_CARD_OFFSET) % block_size
+    return f"DP-{10 ** (digits - 1) + scrambled}"
+
+async def allocate_club_card_codes(count: int) -> List[str]:
+    """Reserve count consecutive club card codes in a single round trip"""
+    counter = await db.counters.find_one_and_update(
+        {"_id": CLUB_CARD_COUNTER_ID},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    end = counter["seq"]
+    return [format_club_card_code(sequence) for sequence in range(end - count, end)]
+
+async def allocate_club_card_code() -> str:
+    return (await allocate_club_card_codes(1))[0]
 
 def generate_club_card_qr_url(user_id: str) -> str:
     """Generate QR code URL for club card - opens popup"""
@@ -63,13 +112,7 @@ async def initialize_club_card(user_id: str):
     
     # Generate club card code if not exists
     if not user_doc.get("club_card_code"):
-        # Generate unique code
-        while True:
-            code = generate_club_card_code()
-            existing = await db.users.find_one({"club_card_code": code})
-            if not existing:
-                update_data["club_card_code"] = code
-                break
+        update_data["club_card_code"] = await allocate_club_card_code()
     
     # Generate QR URL if not exists
     if not user_doc.get("club_card_qr_url"):
@@ -83,6 +126,7 @@ async def initialize_club_card(user_id: str):
     # Update user if needed
     if update_data:
         await db.users.update_one({"id": user_id}, {"$set": update_data})
+        principal_cache.invalidate(user_id)
 
 async def send_email(to_email: str, subject: str, body: str) -> bool:
     """Send email using Gmail SMTP"""
@@ -131,10 +175,7 @@ class User(BaseModel):
     password_hash: str
     country: str
     phone: Optional[str] = None
-    avatar_url: Optional[str] = None
-    current_points: int = 0
-    total_points: int = 0
-    level: str = "Explorer"  # Explorer, Local Friend, Ambassador, Legend
+    avatar_hash: Optional[str] = None
     badges: List[str] = Field(default_factory=list)
     position: int = 0
     preferred_lang: str = "IT"  # IT, EN
@@ -153,6 +194,17 @@ class User(BaseModel):
     user_rank: Optional[int] = None
     winners_history: List[dict] = Field(default_factory=list)
     last_prize_use_date: Optional[datetime] = None
+    # Bumped to revoke every token issued before
+    token_version: int = 0
+
+class UserStats(BaseModel):
+    """Counters rewritten on every award or visit, kept apart from the large user document"""
+    user_id: str
+    country: str = ""  # mirrored from the user so rankings read only user_stats
+    current_points: int = 0
+    total_points: int = 0
+    level: str = "Explorer"  # Explorer, Local Friend, Ambassador, Legend
+    last_seen_at: Optional[datetime] = None
 
 class UserCreate(BaseModel):
     name: str
@@ -161,6 +213,12 @@ class UserCreate(BaseModel):
     password: str
     country: str
 
+class TokenClaims(BaseModel):
+    id: str
+    username: str
+    is_admin: bool = False
+    ver: int = 0
+
 class UserLogin(BaseModel):
     email: EmailStr
     password: str
@@ -211,7 +269,7 @@ class Prize(BaseModel):
     position: int  # 1, 2, 3
     title: str
     description: str
-    image_url: Optional[str] = None
+    image_hash: Optional[str] = None
     month_year: str
     winner_id: Optional[str] = None
     claimed: bool = False
@@ -256,7 +314,7 @@ class MissionUpdateRequest(BaseModel):
 class PrizeUpdateRequest(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
-    image_url: Optional[str] = None
+    image_hash: Optional[str] = None
 
 class Translation(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -282,7 +340,7 @@ class MissionSubmission(BaseModel):
     mission_id: str
     mission_title: str
     description: str
-    photo_url: Optional[str] = None
+    photo_hash: Optional[str] = None
     submission_url: Optional[str] = None
     verification_status: str = "pending"  # pending, approved, rejected
     submitted_at: datetime = Field(default_factory=datetime.utcnow)
@@ -291,6 +349,20 @@ class MissionSubmission(BaseModel):
     points_earned: int
     month_year: str
 
+class PhotoUpload(BaseModel):
+    """A resumable photo upload: chunks land in a part file until offset reaches size"""
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    size: int
+    offset: int = 0
+    status: str = "open"  # open, complete
+    photo_hash: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime
+
+class PhotoUploadRequest(BaseModel):
+    size: int
+
 class UserMission(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
@@ -320,6 +392,16 @@ class QuizCompletion(BaseModel):
     points_earned: int
     completed_at: datetime = Field(default_factory=datetime.utcnow)
 
+class PointsLedgerEntry(BaseModel):
+    id: str  # "<source>:<source_id>", so the same record can never be credited twice
+    user_id: str
+    points: int
+    source: str  # action, mission, quiz
+    source_id: str
+    month_year: str
+    day: str  # "2025-01-31" format
+    ts: datetime = Field(default_factory=datetime.utcnow)
+
 class WinnersArchive(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
@@ -396,6 +478,553 @@ class MultiLanguageText(BaseModel):
     updated_by: str  # admin_id
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+# === RANK ENGINE ===
+
+class _RankEnd:
+    """Sentinel key that sorts after every real key"""
+    def __lt__(self, other):
+        return False
+    
+    def __le__(self, other):
+        return False
+
+class _RankNode:
+    __slots__ = ("key", "next", "width")
+    
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next = [None] * level
+        self.width = [1] * level
+
+class RankIndex:
+    """Indexable skip list: insert, remove, rank and positional access in O(log n)"""
+    MAX_LEVELS = 24
+    
+    def __init__(self):
+        self.size = 0
+        self.tail = _RankNode(_RankEnd(), 0)
+        self.head = _RankNode(None, self.MAX_LEVELS)
+        self.head.next = [self.tail] * self.MAX_LEVELS
+    
+    def __len__(self):
+        return self.size
+    
+    def insert(self, key):
+        chain = [None] * self.MAX_LEVELS
+        steps_at_level = [0] * self.MAX_LEVELS
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        
+        depth = 1
+        while depth < self.MAX_LEVELS and random.random() < 0.5:
+            depth += 1
+        
+        new_node = _RankNode(key, depth)
+        steps = 0
+        for level in range(depth):
+            prev_node = chain[level]
+            new_node.next[level] = prev_node.next[level]
+            prev_node.next[level] = new_node
+            new_node.width[level] = prev_node.width[level] - steps
+            prev_node.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(depth, self.MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+    
+    def remove(self, key):
+        chain = [None] * self.MAX_LEVELS
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+        
+        target = chain[0].next[0]
+        if target is self.tail or target.key != key:
+            raise KeyError(key)
+        
+        for level in range(len(target.next)):
+            prev_node = chain[level]
+            prev_node.width[level] += target.width[level] - 1
+            prev_node.next[level] = target.next[level]
+        for level in range(len(target.next), self.MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+    
+    def rank(self, key) -> int:
+        """1-based position of key, or 0 if it is not indexed"""
+        position = 0
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        if node.next[0] is self.tail or node.next[0].key != key:
+            return 0
+        return position + 1
+    
+    def slice(self, start: int, stop: int) -> list:
+        """Keys at 0-based positions [start, stop)"""
+        start = max(start, 0)
+        stop = min(stop, self.size)
+        if start >= stop:
+            return []
+        
+        remaining = start + 1
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        
+        keys = []
+        while len(keys) < stop - start:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+class LeaderboardRanking:
+    """In-memory ranking of the current month's scores, mirrored from monthly_scores.
+    
+    Besides the global index, every user is kept in precomputed country, level and
+    country+level partitions so filtered views are read the same way as the global one.
+    """
+    
+    def __init__(self):
+        self.month_year: Optional[str] = None
+        self.index = RankIndex()
+        self.keys: Dict[str, tuple] = {}
+        self.attributes: Dict[str, tuple] = {}
+        self.partitions: Dict[tuple, RankIndex] = {}
+    
+    def reset(self, month_year: str):
+        self.month_year = month_year
+        self.index = RankIndex()
+        self.keys = {}
+        self.attributes = {}
+        self.partitions = {}
+    
+    @staticmethod
+    def partition_key(country: Optional[str] = None, level: Optional[str] = None) -> Optional[tuple]:
+        if country and level:
+            return ("country_level", country.strip().upper(), level)
+        if country:
+            return ("country", country.strip().upper())
+        if level:
+            return ("level", level)
+        return None
+    
+    def _partition_keys(self, attributes: tuple) -> List[tuple]:
+        country, level = attributes
+        if not country:
+            return [self.partition_key(level=level)]
+        return [
+            self.partition_key(country=country),
+            self.partition_key(level=level),
+            self.partition_key(country=country, level=level)
+        ]
+    
+    def _unindex(self, user_id: str):
+        key = self.keys.pop(user_id, None)
+        attributes = self.attributes.pop(user_id, None)
+        if key is None:
+            return
+        self.index.remove(key)
+        for partition in self._partition_keys(attributes):
+            self.partitions[partition].remove(key)
+    
+    def _index(self, user_id: str, key: tuple, attributes: tuple):
+        self.keys[user_id] = key
+        self.attributes[user_id] = attributes
+        self.index.insert(key)
+        for partition in self._partition_keys(attributes):
+            self.partitions.setdefault(partition, RankIndex()).insert(key)
+    
+    def update(self, user_id: str, points: int, last_award_at: datetime, country: str, level: str):
+        """Index a user's monthly score.
+        
+        Scores only grow, so one at or below the indexed points is an older read that lost a
+        race with a newer award (or with a reload's cursor) and is ignored.
+        """
+        key = self.keys.get(user_id)
+        if key is not None and points <= -key[0]:
+            return
+        self._unindex(user_id)
+        self._index(user_id, (-points, last_award_at, user_id), (country or "", level))
+    
+    def set_attributes(self, user_id: str, country: Optional[str] = None, level: Optional[str] = None):
+        """Move an already ranked user between partitions, keeping their score"""
+        key = self.keys.get(user_id)
+        if key is None:
+            return
+        old_country, old_level = self.attributes[user_id]
+        self._unindex(user_id)
+        self._index(user_id, key, (country if country is not None else old_country, level or old_level))
+    
+    def partition(self, partition: Optional[tuple] = None) -> RankIndex:
+        if partition is None:
+            return self.index
+        return self.partitions.get(partition) or RankIndex()
+    
+    def rank(self, user_id: str, partition: Optional[tuple] = None) -> Optional[int]:
+        key = self.keys.get(user_id)
+        if key is None:
+            return None
+        return self.partition(partition).rank(key) or None
+    
+    def points(self, user_id: str) -> int:
+        key = self.keys.get(user_id)
+        return -key[0] if key is not None else 0
+    
+    def range(self, start: int, stop: int, partition: Optional[tuple] = None) -> List[dict]:
+        """Entries at 0-based positions [start, stop) as position/user_id/points dicts"""
+        start = max(start, 0)
+        return [
+            {"position": start + offset + 1, "user_id": key[2], "points": -key[0]}
+            for offset, key in enumerate(self.partition(partition).slice(start, stop))
+        ]
+    
+    def top(self, n: int, partition: Optional[tuple] = None) -> List[dict]:
+        return self.range(0, n, partition)
+    
+    def around(self, user_id: str, radius: int) -> List[dict]:
+        position = self.rank(user_id)
+        if position is None:
+            return []
+        return self.range(position - 1 - radius, position + radius)
+
+leaderboard_ranking = LeaderboardRanking()
+
+class RankHistory:
+    """Daily rank snapshots kept in memory as packed arrays of interned user numbers"""
+    
+    def __init__(self, max_days: int = 90):
+        self.max_days = max_days
+        self.user_numbers: Dict[str, int] = {}
+        self.days: OrderedDict = OrderedDict()
+        self._positions_day: Optional[str] = None
+        self._positions = array('I')
+    
+    def add(self, day: str, month_year: str, user_ids: List[str]):
+        numbers = array('I')
+        for user_id in user_ids:
+            numbers.append(self.user_numbers.setdefault(user_id, len(self.user_numbers)))
+        self.days[day] = (month_year, numbers)
+        self.days = OrderedDict(sorted(self.days.items())[-self.max_days:])
+        if self._positions_day == day:
+            self._positions_day = None
+    
+    def position(self, day: str, user_id: str) -> Optional[int]:
+        """1-based rank of a user in a day's snapshot"""
+        if day not in self.days or user_id not in self.user_numbers:
+            return None
+        if self._positions_day != day:
+            # Inverse of the snapshot, indexed by user number; 0 means unranked
+            positions = array('I', bytes(4 * len(self.user_numbers)))
+            for position, number in enumerate(self.days[day][1], 1):
+                positions[number] = position
+            self._positions_day = day
+            self._positions = positions
+        number = self.user_numbers[user_id]
+        if number >= len(self._positions):
+            return None
+        return self._positions[number] or None
+    
+    def delta(self, user_id: str, position: Optional[int]) -> Optional[int]:
+        """Places gained (positive) or lost since yesterday's close, within the same month"""
+        yesterday = (local_now().date() - timedelta(days=1)).strftime("%Y-%m-%d")
+        if position is None or yesterday not in self.days:
+            return None
+        if self.days[yesterday][0] != get_current_month_year():
+            return None
+        previous = self.position(yesterday, user_id)
+        return previous - position if previous is not None else None
+
+rank_history = RankHistory()
+
+class LeaderboardBroadcaster:
+    """Pushes coalesced rank diffs of the current month to stream subscribers"""
+    
+    def __init__(self, window: float = 1.0, top_n: int = 50, queue_size: int = 16):
+        self.window = window
+        self.top_n = top_n
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.dirty = set()
+        self.flush_task: Optional[asyncio.Task] = None
+        self.month_year: Optional[str] = None
+        self.last_sent: Dict[str, tuple] = {}
+    
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        return queue
+    
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+    
+    def notify(self, user_id: str):
+        """Mark a user's score as changed; a diff goes out once the window closes"""
+        self.dirty.add(user_id)
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_later())
+    
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self.flush_task = None
+        self.flush(leaderboard_ranking)
+    
+    def flush(self, ranking: LeaderboardRanking):
+        dirty, self.dirty = self.dirty, set()
+        
+        if ranking.month_year != self.month_year:
+            self.month_year = ranking.month_year
+            self.last_sent = {}
+            self.publish({"type": "resync", "month_year": ranking.month_year})
+            return
+        
+        current = {entry["user_id"]: entry for entry in ranking.top(self.top_n)}
+        for user_id in dirty - current.keys():
+            position = ranking.rank(user_id)
+            if position is not None:
+                current[user_id] = {"position": position, "user_id": user_id, "points": ranking.points(user_id)}
+        
+        changes = [
+            entry for user_id, entry in current.items()
+            if self.last_sent.get(user_id) != (entry["position"], entry["points"])
+        ]
+        removed = [user_id for user_id in self.last_sent if user_id not in current]
+        self.last_sent = {user_id: (entry["position"], entry["points"]) for user_id, entry in current.items()}
+        
+        if changes or removed:
+            changes.sort(key=lambda entry: entry["position"])
+            self.publish({
+                "type": "ranks",
+                "month_year": ranking.month_year,
+                "total_participants": len(ranking.index),
+                "changes": changes,
+                "removed": removed
+            })
+    
+    def publish(self, event: dict):
+        for queue in self.subscribers:
+            if queue.full():
+                # A slow client gets its backlog dropped and refetches instead
+                while not queue.empty():
+                    queue.get_nowait()
+                event_to_send = {"type": "resync", "month_year": event["month_year"]}
+            else:
+                event_to_send = event
+            queue.put_nowait(event_to_send)
+
+leaderboard_broadcaster = LeaderboardBroadcaster()
+
+# === MEDIA STORAGE ===
+
+# Blobs are addressed by the SHA-256 of their bytes, so a stored blob never changes
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Widths a stored image can be served at through ?w=; requests snap up to the next one
+MEDIA_RENDITIONS = {"thumb": 96, "card": 400, "full": 1600}
+
+def media_url(blob_hash: Optional[str], width: Optional[int] = None) -> Optional[str]:
+    """Path of a stored image on the API, derived from its content hash; clients prefix the API origin"""
+    if not blob_hash:
+        return None
+    return f"/api/media/{blob_hash}?w={width}" if width else f"/api/media/{blob_hash}"
+
+def rendition_width(width: int) -> int:
+    widths = sorted(MEDIA_RENDITIONS.values())
+    return next((candidate for candidate in widths if candidate >= width), widths[-1])
+
+def sniff_image_type(data: bytes) -> Optional[str]:
+    """Media type of an encoded image from its magic bytes"""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return None
+
+class LocalBlobStore:
+    """Blobs as files under root, sharded by the first two characters of their hash"""
+    
+    def __init__(self, root: Path):
+        self.root = root
+    
+    def _path(self, blob_hash: str) -> Path:
+        return self.root / blob_hash[:2] / blob_hash
+    
+    def _write(self, blob_hash: str, data: bytes):
+        path = self._path(blob_hash)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write aside and rename so readers never see a partial blob
+        temp_path = path.with_name(f"{blob_hash}.{uuid.uuid4().hex}.tmp")
+        temp_path.write_bytes(data)
+        os.replace(temp_path, path)
+    
+    def _read(self, blob_hash: str) -> Optional[bytes]:
+        try:
+            return self._path(blob_hash).read_bytes()
+        except FileNotFoundError:
+            return None
+    
+    async def put(self, blob_hash: str, data: bytes):
+        await asyncio.to_thread(self._write, blob_hash, data)
+    
+    async def get(self, blob_hash: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._read, blob_hash)
+
+class GridFSBlobStore:
+    """Blobs in a GridFS bucket, one file per hash"""
+    
+    def __init__(self, database):
+        self.bucket = AsyncIOMotorGridFSBucket(database, bucket_name="blobs")
+    
+    async def put(self, blob_hash: str, data: bytes):
+        if await self.bucket.find({"filename": blob_hash}).limit(1).to_list(1):
+            return
+        await self.bucket.upload_from_stream(blob_hash, data)
+    
+    async def get(self, blob_hash: str) -> Optional[bytes]:
+        try:
+            stream = await self.bucket.open_download_stream_by_name(blob_hash)
+        except NoFile:
+            return None
+        return await stream.read()
+
+MEDIA_ROOT = Path(os.environ.get('MEDIA_ROOT', ROOT_DIR / 'media'))
+
+if os.environ.get('BLOB_STORE', 'local') == 'gridfs':
+    blob_store = GridFSBlobStore(db)
+else:
+    blob_store = LocalBlobStore(MEDIA_ROOT)
+
+class RenditionCache:
+    """Resized images on local disk, evicted least-recently-used beyond max_bytes"""
+    
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # file name -> size
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def load(self):
+        """Index what a previous run left on disk, oldest first"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        files = [entry for entry in os.scandir(self.root) if entry.is_file() and not entry.name.endswith(".tmp")]
+        for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+            self.entries[entry.name] = entry.stat().st_size
+            self.total_bytes += entry.stat().st_size
+        self._remove(self._evict())
+    
+    def _evict(self) -> List[str]:
+        evicted = []
+        while self.total_bytes > self.max_bytes and self.entries:
+            name, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            evicted.append(name)
+        return evicted
+    
+    def _remove(self, names: List[str]):
+        for name in names:
+            (self.root / name).unlink(missing_ok=True)
+    
+    def _write(self, name: str, data: bytes):
+        self.root.mkdir(parents=True, exist_ok=True)
+        temp_path = self.root / f"{name}.{uuid.uuid4().hex}.tmp"
+        temp_path.write_bytes(data)
+        os.replace(temp_path, self.root / name)
+    
+    async def get(self, name: str) -> Optional[bytes]:
+        if name not in self.entries:
+            self.misses += 1
+            return None
+        try:
+            data = await asyncio.to_thread((self.root / name).read_bytes)
+        except FileNotFoundError:
+            self.total_bytes -= self.entries.pop(name, 0)
+            self.misses += 1
+            return None
+        if name in self.entries:
+            self.entries.move_to_end(name)
+        self.hits += 1
+        return data
+    
+    async def put(self, name: str, data: bytes):
+        await asyncio.to_thread(self._write, name, data)
+        self.total_bytes -= self.entries.pop(name, 0)
+        self.entries[name] = len(data)
+        self.total_bytes += len(data)
+        evicted = self._evict()
+        if evicted:
+            await asyncio.to_thread(self._remove, evicted)
+    
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+rendition_cache = RenditionCache(
+    Path(os.environ.get('RENDITION_CACHE_DIR', MEDIA_ROOT / 'renditions')),
+    max_bytes=int(os.environ.get('RENDITION_CACHE_MB', 512)) * 1024 * 1024
+)
+
+async def store_blob(data: bytes) -> str:
+    """Store bytes once and return their hash; identical uploads share a blob"""
+    blob_hash = hashlib.sha256(data).hexdigest()
+    await blob_store.put(blob_hash, data)
+    return blob_hash
+
+# Base64 images that used to be stored inline, and the hash field replacing each
+INLINE_IMAGE_FIELDS = [
+    ("users", "avatar_url", "avatar_hash"),
+    ("mission_submissions", "photo_url", "photo_hash"),
+    ("prizes", "image_url", "image_hash")
+]
+
+async def migrate_inline_images():
+    """Move base64 images out of documents into the blob store, leaving only their hash"""
+    for collection_name, inline_field, hash_field in INLINE_IMAGE_FIELDS:
+        collection = db[collection_name]
+        moved = 0
+        async for doc in collection.find(
+            {inline_field: {"$type": "string", "$ne": ""}},
+            {"_id": 1, inline_field: 1},
+            batch_size=100
+        ):
+            try:
+                data = base64.b64decode(doc[inline_field].split(",", 1)[-1])
+            except ValueError:
+                data = b""
+            if not sniff_image_type(data):
+                logging.warning(f"Skipping non-image {collection_name}.{inline_field} on {doc['_id']}")
+                continue
+            
+            await collection.update_one(
+                {"_id": doc["_id"]},
+                {"$set": {hash_field: await store_blob(data)}, "$unset": {inline_field: ""}}
+            )
+            moved += 1
+        if moved:
+            logging.info(f"Moved {moved} inline images from {collection_name}.{inline_field} to the blob store")
+
 # === HELPER FUNCTIONS ===
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -408,31 +1037,324 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
+def user_token_claims(user: User) -> dict:
+    """Compact claim set that lets routes authorize without reading the user"""
+    return {
+        "sub": user.id,
+        "username": user.username,
+        "is_admin": user.is_admin,
+        "ver": user.token_version
+    }
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+class BoundedExecutor:
+    """Runs blocking work on an executor, answering 503 instead of queueing without limit"""
+    
+    def __init__(self, executor, workers: int, max_queue: int):
+        self.executor = executor
+        self.workers = workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+    
+    async def run(self, func, *args):
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Server busy, please retry shortly",
+                headers={"Retry-After": "1"}
+            )
+        
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.in_flight -= 1
+            self.completed += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+    
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": max(0, self.in_flight - self.workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_ms": round(1000 * self.total_seconds / self.completed, 1) if self.completed else 0,
+            "max_ms": round(1000 * self.max_seconds, 1)
+        }
+
+class PasswordHasher(BoundedExecutor):
+    """Runs bcrypt on a bounded thread pool so password work never blocks the event loop"""
+    
+    def __init__(self, workers: int, max_queue: int):
+        super().__init__(ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt"), workers, max_queue)
+    
+    async def hash(self, password: str) -> str:
+        return await self.run(get_password_hash, password)
+    
+    async def verify_and_update(self, password: str, hashed_password: str):
+        """(valid, new_hash); new_hash is set when the stored hash uses another bcrypt cost"""
+        return await self.run(pwd_context.verify_and_update, password, hashed_password)
+    
+    def stats(self) -> dict:
+        return {**super().stats(), "bcrypt_rounds": BCRYPT_ROUNDS}
+
+password_hasher = PasswordHasher(
+    workers=int(os.environ.get('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1))),
+    max_queue=int(os.environ.get('PASSWORD_HASH_QUEUE', 64))
+)
+
+# PIL decode/resize/encode runs in worker processes; spawned rather than forked so the
+# workers start clean of the event loop and Mongo client threads
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', os.cpu_count() or 1))
+image_processor = BoundedExecutor(
+    ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn")),
+    workers=IMAGE_WORKERS,
+    max_queue=int(os.environ.get('IMAGE_QUEUE', 32))
+)
+
+# Bulk user imports hash passwords on worker processes, spawned for the same reason; the
+# queue fits a couple of concurrent imports split four chunks per worker
+IMPORT_HASH_WORKERS = int(os.environ.get('IMPORT_HASH_WORKERS', os.cpu_count() or 1))
+import_hasher = BoundedExecutor(
+    ProcessPoolExecutor(max_workers=IMPORT_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")),
+    workers=IMPORT_HASH_WORKERS,
+    max_queue=int(os.environ.get('IMPORT_HASH_QUEUE', IMPORT_HASH_WORKERS * 8))
+)
+
+# Output size and JPEG quality of each kind of upload
+AVATAR_IMAGE = ((400, 400), 85, True)
+MISSION_PHOTO = ((800, 600), 85, False)
+PRIZE_IMAGE = ((400, 300), 90, False)
+
+# Hard limits on uploads: request bytes are enforced while streaming, pixels from the header
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_MB', 10)) * 1024 * 1024
+UPLOAD_MAX_PIXELS = int(os.environ.get('UPLOAD_MAX_MEGAPIXELS', 40)) * 1_000_000
+# Room for the other form fields and multipart boundaries around the file
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+class UploadSizeLimitMiddleware:
+    """Rejects multipart bodies over max_bytes with 413 while they stream in.
+
+    Starlette spools each uploaded file to a temporary file beyond 1 MB, so with this
+    cap the memory and disk an upload can take are both bounded.
+    """
+    
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            return await self.app(scope, receive, send)
+        
+        too_large = JSONResponse({"detail": "Upload too large"}, status_code=413)
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            return await too_large(scope, receive, send)
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail="Upload too large")
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
+async def read_upload_image(file: UploadFile) -> bytes:
+    """Bytes of an uploaded image, once its header shows it is within the pixel limit.
+
+    Raises InvalidImage when the header is not a supported image.
+    """
+    if file.size is not None and file.size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Upload too large")
+    try:
+        await asyncio.to_thread(probe_image, file.file, UPLOAD_MAX_PIXELS)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return await file.read()
+
+async def process_upload_image(data: bytes, spec: tuple) -> bytes:
+    """Resize and re-encode an image on the image worker pool; raises InvalidImage"""
+    max_size, quality, crop = spec
+    return await image_processor.run(process_image, data, max_size, quality, crop)
+
+# Resumable uploads keep the bytes received so far in a part file until they are finalized
+UPLOAD_PARTS_DIR = Path(os.environ.get('UPLOAD_PARTS_DIR', MEDIA_ROOT / 'uploads'))
+# Uploads that receive no chunk for this long are abandoned and swept
+UPLOAD_EXPIRY = timedelta(hours=int(os.environ.get('UPLOAD_EXPIRY_HOURS', 24)))
+# A chunk streaming in is written to disk in blocks of this size
+UPLOAD_WRITE_BLOCK = 256 * 1024
+
+# Uploads with a chunk streaming into this process; a concurrent chunk for the same one is refused
+uploads_receiving = set()
+
+def upload_part_path(upload_id: str) -> Path:
+    return UPLOAD_PARTS_DIR / f"{upload_id}.part"
+
+def create_upload_part(upload_id: str):
+    UPLOAD_PARTS_DIR.mkdir(parents=True, exist_ok=True)
+    upload_part_path(upload_id).touch()
+
+def write_upload_part(upload_id: str, offset: int, data: bytes):
+    """Write data at offset, dropping any bytes past it that an interrupted chunk left behind"""
+    with open(upload_part_path(upload_id), "r+b") as part:
+        part.seek(offset)
+        part.truncate()
+        part.write(data)
+
+def read_upload_part(upload_id: str) -> bytes:
+    """Bytes of a fully received upload, once its header shows it is within the pixel limit"""
+    with open(upload_part_path(upload_id), "rb") as part:
+        probe_image(part, UPLOAD_MAX_PIXELS)
+        return part.read()
+
+async def receive_upload_chunk(upload: dict, request: Request) -> int:
+    """Write a PATCH body into an upload's part file as it streams in; returns the bytes kept.
+
+    When the client drops mid-chunk, what already arrived is kept so it can resume from there.
+    """
+    offset = upload["offset"]
+    remaining = upload["size"] - offset
+    written = 0
+    buffer = bytearray()
+    try:
+        async for chunk in request.stream():
+            if written + len(buffer) + len(chunk) > remaining:
+                raise HTTPException(status_code=413, detail="Chunk runs past the declared upload size")
+            buffer += chunk
+            if len(buffer) >= UPLOAD_WRITE_BLOCK:
+                await asyncio.to_thread(write_upload_part, upload["id"], offset + written, bytes(buffer))
+                written += len(buffer)
+                buffer.clear()
+    except ClientDisconnect:
+        pass
+    if buffer:
+        await asyncio.to_thread(write_upload_part, upload["id"], offset + written, bytes(buffer))
+        written += len(buffer)
+    return written
+
+def remove_stale_upload_parts(cutoff: float) -> int:
+    if not UPLOAD_PARTS_DIR.exists():
+        return 0
+    removed = 0
+    for entry in os.scandir(UPLOAD_PARTS_DIR):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            Path(entry.path).unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+async def expire_uploads():
+    """Drop uploads that stopped receiving chunks, along with their part files"""
+    result = await db.uploads.delete_many({"expires_at": {"$lt": datetime.utcnow()}})
+    removed = await asyncio.to_thread(remove_stale_upload_parts, time.time() - UPLOAD_EXPIRY.total_seconds())
+    if result.deleted_count or removed:
+        logging.info(f"Expired {result.deleted_count} abandoned uploads and {removed} part files")
+
+async def run_upload_expiry():
+    """Background job: sweep abandoned uploads once an hour"""
+    while True:
+        try:
+            await expire_uploads()
+        except Exception as e:
+            logging.error(f"Failed to expire uploads: {str(e)}")
+        await asyncio.sleep(3600)
+
+async def hash_passwords_parallel(passwords: List[str]) -> List[str]:
+    """Hash many passwords at once across all cores, for bulk imports"""
+    if not passwords:
+        return []
+    chunk_size = max(1, math.ceil(len(passwords) / (import_hasher.workers * 4)))
+    chunks = [passwords[start:start + chunk_size] for start in range(0, len(passwords), chunk_size)]
+    
+    results = await asyncio.gather(*[
+        import_hasher.run(hash_password_batch, chunk, BCRYPT_ROUNDS) for chunk in chunks
+    ])
+    return [password_hash for chunk in results for password_hash in chunk]
+
+# Day, week and month buckets roll over at midnight in this timezone whatever the server
+# clock is set to; the ledger backfill derives its buckets in the same zone
+APP_TIMEZONE = os.environ.get('APP_TIMEZONE', 'UTC')
+APP_TZ = ZoneInfo(APP_TIMEZONE)
+
+def local_now() -> datetime:
+    """Naive wall-clock time in APP_TIMEZONE, the one clock behind every bucket key"""
+    return datetime.now(APP_TZ).replace(tzinfo=None)
+
 def get_current_month_year() -> str:
-    return datetime.now().strftime("%Y-%m")
+    return local_now().strftime("%Y-%m")
+
+def get_current_day() -> str:
+    return local_now().strftime("%Y-%m-%d")
+
+def get_current_week_days() -> List[str]:
+    """Day buckets of the current Monday-to-Sunday week up to today"""
+    today = local_now().date()
+    week_start = today - timedelta(days=today.weekday())
+    return [(week_start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(today.weekday() + 1)]
+
+# Level thresholds on total points, highest first
+USER_LEVELS = [
+    (2000, "Legend"),
+    (1000, "Ambassador"),
+    (500, "Local Friend"),
+    (0, "Explorer")
+]
 
 def get_user_level(total_points: int) -> str:
-    if total_points >= 2000:
-        return "Legend"
-    elif total_points >= 1000:
-        return "Ambassador"
-    elif total_points >= 500:
-        return "Local Friend"
-    else:
-        return "Explorer"
+    for threshold, level in USER_LEVELS:
+        if total_points >= threshold:
+            return level
+    return USER_LEVELS[-1][1]
+
+# get_user_level as an aggregation expression over a document's total_points
+USER_LEVEL_EXPRESSION = {
+    "$switch": {
+        "branches": [
+            {"case": {"$gte": ["$total_points", threshold]}, "then": level}
+            for threshold, level in USER_LEVELS[:-1]
+        ],
+        "default": USER_LEVELS[-1][1]
+    }
+}
+
+def duplicate_key_field(details: Optional[dict]) -> Optional[str]:
+    """Name of the field whose unique index rejected a write, from the error details"""
+    details = details or {}
+    key_pattern = details.get("keyPattern") or details.get("keyValue") or {}
+    if key_pattern:
+        return next(iter(key_pattern))
+    for field in ["email", "username", "club_card_code"]:
+        if f"index: {field}_1" in details.get("errmsg", ""):
+            return field
+    return None
 
-def generate_club_card_code() -> str:
-    """Generate unique club card code DP-XXXX"""
-    import random
-    import string
-    suffix = ''.join(random.choices(string.digits, k=4))
-    return f"DP-{suffix}"
+DUPLICATE_USER_MESSAGES = {
+    "email": "Email already registered",
+    "username": "Username already taken"
+}
 
 def generate_qr_code(data: str) -> str:
     """Generate QR code for club card"""
@@ -508,6 +1430,448 @@ async def set_system_config(key: str, value: str, admin_id: str = None):
         upsert=True
     )
 
+class LRUCache:
+    """Small bounded in-process cache with least-recently-used eviction and optional TTL"""
+    
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.items = OrderedDict()
+    
+    def get(self, key):
+        if key not in self.items:
+            return None
+        value, expires_at = self.items[key]
+        if expires_at is not None and expires_at < time.monotonic():
+            del self.items[key]
+            return None
+        self.items.move_to_end(key)
+        return value
+    
+    def put(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self.items[key] = (value, expires_at)
+        self.items.move_to_end(key)
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+    
+    def invalidate(self, key):
+        self.items.pop(key, None)
+
+class BloomFilter:
+    """Bit-array set membership with no false negatives and a bounded false-positive rate"""
+    
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+    
+    def _positions(self, key: str):
+        # Double hashing: two 64-bit halves of one blake2b digest give all k positions
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+    
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+    
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+# Usernames and emails in use, for availability checks that mostly avoid the database.
+# Both hold values exactly as stored: usernames are case-sensitive like their unique index,
+# and emails are kept in the form EmailStr gives them on registration.
+username_filter = BloomFilter(100000)
+email_filter = BloomFilter(100000)
+
+EMAIL_ADAPTER = TypeAdapter(EmailStr)
+
+def normalize_email(email: str) -> str:
+    """An address as registration would store it (EmailStr lowercases the domain)"""
+    try:
+        return EMAIL_ADAPTER.validate_python(email)
+    except ValidationError:
+        raise HTTPException(status_code=400, detail="Invalid email address")
+
+def remember_identity(username: Optional[str] = None, email: Optional[str] = None):
+    if username:
+        username_filter.add(username)
+    if email:
+        email_filter.add(email)
+
+async def load_identity_filters():
+    """Rebuild the username/email filters from the users collection"""
+    global username_filter, email_filter
+    # Leave headroom for sign-ups until the next restart
+    capacity = max(100000, 2 * await db.users.count_documents({}))
+    usernames, emails = BloomFilter(capacity), BloomFilter(capacity)
+    async for user in db.users.find({}, {"_id": 0, "username": 1, "email": 1}, batch_size=10000):
+        if user.get("username"):
+            usernames.add(user["username"])
+        if user.get("email"):
+            emails.add(user["email"])
+    username_filter, email_filter = usernames, emails
+
+async def identity_available(field: str, value: str, bloom: BloomFilter) -> bool:
+    """True unless a user already holds value; only possible hits reach the index"""
+    if value not in bloom:
+        return True
+    return not await db.users.find_one({field: value}, {"_id": 0, "id": 1})
+
+# Leaderboard ordering: most points first, ties go to whoever got there first
+LEADERBOARD_SORT = [("points", -1), ("last_award_at", 1)]
+
+async def record_monthly_score(entry: PointsLedgerEntry, country: str, level: str):
+    """Increment the materialized monthly score used by the leaderboard"""
+    score = await db.monthly_scores.find_one_and_update(
+        {"user_id": entry.user_id, "month_year": entry.month_year},
+        {
+            "$inc": {"points": entry.points},
+            "$set": {"last_award_at": entry.ts}
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    
+    ranking = await get_leaderboard_ranking()
+    if ranking.month_year == entry.month_year:
+        ranking.update(entry.user_id, score["points"], score["last_award_at"], country, level)
+        leaderboard_broadcaster.notify(entry.user_id)
+
+async def record_score_buckets(entry: PointsLedgerEntry):
+    """Increment the day's bucket and the all-time rollup for the weekly and all-time windows"""
+    update = {
+        "$inc": {"points": entry.points},
+        "$set": {"last_award_at": entry.ts}
+    }
+    await asyncio.gather(
+        db.daily_scores.update_one({"user_id": entry.user_id, "day": entry.day}, update, upsert=True),
+        db.alltime_scores.update_one({"user_id": entry.user_id}, update, upsert=True)
+    )
+
+async def award_points(
+    user_id: str,
+    points: int,
+    month_year: str,
+    source: str,
+    source_id: str
+) -> Optional[dict]:
+    """Append an award to the points ledger and update its materializations.
+    
+    Returns None without touching anything if the source record was already credited.
+    """
+    entry = PointsLedgerEntry(
+        id=f"{source}:{source_id}",
+        user_id=user_id,
+        points=points,
+        source=source,
+        source_id=source_id,
+        month_year=month_year,
+        day=get_current_day()
+    )
+    try:
+        await db.points_ledger.insert_one(entry.dict())
+    except DuplicateKeyError:
+        return None
+    
+    stats_doc = await increment_user_points(user_id, points)
+    if stats_doc is None:
+        # Users created outside the API (e.g. by init_admin.py) get their stats on first award
+        await sync_user_stats({"id": user_id})
+        stats_doc = await increment_user_points(user_id, points)
+    if stats_doc:
+        await asyncio.gather(
+            record_monthly_score(entry, stats_doc["country"], stats_doc["level"]),
+            record_score_buckets(entry)
+        )
+    return stats_doc
+
+async def increment_user_points(user_id: str, points: int) -> Optional[dict]:
+    """Add points to a user's stats; points and the level derived from them change in a single write"""
+    return await db.user_stats.find_one_and_update(
+        {"user_id": user_id},
+        [
+            {"$set": {
+                "current_points": {"$add": [{"$ifNull": ["$current_points", 0]}, points]},
+                "total_points": {"$add": [{"$ifNull": ["$total_points", 0]}, points]}
+            }},
+            {"$set": {"level": USER_LEVEL_EXPRESSION}}
+        ],
+        projection={"_id": 0, "country": 1, "total_points": 1, "level": 1},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def sync_user_stats(match: Optional[dict] = None):
+    """Create user_stats for users that have none, seeded from the counters on their user document"""
+    await db.users.aggregate([
+        {"$match": match or {}},
+        {
+            "$project": {
+                "_id": 0,
+                "user_id": "$id",
+                "country": {"$ifNull": ["$country", ""]},
+                "current_points": {"$ifNull": ["$current_points", 0]},
+                "total_points": {"$ifNull": ["$total_points", 0]},
+                "level": USER_LEVEL_EXPRESSION,
+                "last_seen_at": {"$ifNull": ["$last_seen_at", None]}
+            }
+        },
+        {"$merge": {"into": "user_stats", "on": "user_id", "whenMatched": "keepExisting", "whenNotMatched": "insert"}}
+    ]).to_list(None)
+
+async def get_user_stats(user_id: str) -> UserStats:
+    stats_doc = await db.user_stats.find_one({"user_id": user_id}, {"_id": 0})
+    return UserStats(**stats_doc) if stats_doc else UserStats(user_id=user_id)
+
+async def get_user_stats_map(user_ids: List[str]) -> Dict[str, UserStats]:
+    stats_docs = await db.user_stats.find({"user_id": {"$in": user_ids}}, {"_id": 0}).to_list(None)
+    stats = {stats_doc["user_id"]: UserStats(**stats_doc) for stats_doc in stats_docs}
+    return {user_id: stats.get(user_id) or UserStats(user_id=user_id) for user_id in user_ids}
+
+async def load_leaderboard_ranking(month_year: str):
+    """Load the in-memory ranking for a month from monthly_scores"""
+    leaderboard_ranking.reset(month_year)
+    async for score in db.monthly_scores.aggregate([
+        {"$match": {"month_year": month_year}},
+        {
+            "$lookup": {
+                "from": "user_stats",
+                "localField": "user_id",
+                "foreignField": "user_id",
+                "pipeline": [{"$project": {"_id": 0, "country": 1, "level": 1}}],
+                "as": "stats"
+            }
+        },
+        {"$unwind": "$stats"},
+        {"$project": {"_id": 0, "user_id": 1, "points": 1, "last_award_at": 1, "stats": 1}}
+    ]):
+        leaderboard_ranking.update(
+            score["user_id"],
+            score["points"],
+            score["last_award_at"],
+            score["stats"]["country"],
+            score["stats"]["level"]
+        )
+
+async def get_leaderboard_ranking() -> LeaderboardRanking:
+    """Current month's ranking, reloaded when the month rolls over"""
+    month_year = get_current_month_year()
+    if leaderboard_ranking.month_year != month_year:
+        await load_leaderboard_ranking(month_year)
+    return leaderboard_ranking
+
+async def ledger_standings(day: str) -> List[str]:
+    """User ids in rank order as of the close of a past day, replayed from the points ledger"""
+    rows = await db.points_ledger.aggregate([
+        {"$match": {"month_year": day[:7], "day": {"$lte": day}}},
+        {"$group": {"_id": "$user_id", "points": {"$sum": "$points"}, "last_award_at": {"$max": "$ts"}}},
+        {"$sort": {"points": -1, "last_award_at": 1, "_id": 1}},
+        {"$project": {"_id": 1}}
+    ], allowDiskUse=True).to_list(None)
+    return [row["_id"] for row in rows]
+
+async def take_rank_snapshot(day: str, user_ids: Optional[List[str]] = None):
+    """Store the standings at the close of a day as an array of user ids in rank order.
+    
+    Without user_ids the standings are read as they are now, so this must run right at the close.
+    """
+    month_year = day[:7]
+    if user_ids is None:
+        if leaderboard_ranking.month_year == month_year:
+            user_ids = [key[2] for key in leaderboard_ranking.index.slice(0, len(leaderboard_ranking.index))]
+        else:
+            user_ids = [
+                score["user_id"] async for score in db.monthly_scores.find(
+                    {"month_year": month_year}, {"_id": 0, "user_id": 1}
+                ).sort(LEADERBOARD_SORT)
+            ]
+    
+    await db.rank_snapshots.update_one(
+        {"day": day},
+        {"$set": {"month_year": month_year, "user_ids": user_ids, "taken_at": datetime.utcnow()}},
+        upsert=True
+    )
+    cutoff = (local_now().date() - timedelta(days=rank_history.max_days)).strftime("%Y-%m-%d")
+    await db.rank_snapshots.delete_many({"day": {"$lt": cutoff}})
+    rank_history.add(day, month_year, user_ids)
+
+async def load_rank_history():
+    snapshots = await db.rank_snapshots.find(
+        {}, {"_id": 0, "day": 1, "month_year": 1, "user_ids": 1}
+    ).sort("day", -1).limit(rank_history.max_days).to_list(rank_history.max_days)
+    for snapshot in reversed(snapshots):
+        rank_history.add(snapshot["day"], snapshot["month_year"], snapshot["user_ids"])
+
+async def run_rank_snapshots():
+    """Background job: snapshot the standings once per day, right after midnight"""
+    yesterday = (local_now().date() - timedelta(days=1)).strftime("%Y-%m-%d")
+    if yesterday not in rank_history.days:
+        try:
+            # The live ranking already holds today's awards, so yesterday's close comes from the ledger
+            await take_rank_snapshot(yesterday, await ledger_standings(yesterday))
+        except Exception as e:
+            logging.error(f"Failed to take rank snapshot: {str(e)}")
+    
+    while True:
+        now = local_now()
+        next_midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        await asyncio.sleep((next_midnight - now).total_seconds())
+        try:
+            await take_rank_snapshot(now.strftime("%Y-%m-%d"))
+        except Exception as e:
+            logging.error(f"Failed to take rank snapshot: {str(e)}")
+
+# Score rollups derived from the points ledger, and the ledger fields that key them besides user_id
+SCORE_ROLLUPS = {
+    "monthly_scores": ["month_year"],
+    "daily_scores": ["day"],
+    "alltime_scores": []
+}
+
+async def backfill_points_ledger():
+    """Seed the points ledger from approved actions, missions and quizzes recorded before it existed"""
+    def ledger_stages(source: str, source_id, points, awarded_at, month_year) -> List[dict]:
+        return [
+            {"$project": {
+                "_id": 0,
+                "id": {"$concat": [f"{source}:", source_id]},
+                "user_id": 1,
+                "points": points,
+                "source": {"$literal": source},
+                "source_id": source_id,
+                "month_year": month_year,
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": awarded_at, "timezone": APP_TIMEZONE}},
+                "ts": awarded_at
+            }},
+            {"$merge": {"into": "points_ledger", "on": "id", "whenMatched": "keepExisting", "whenNotMatched": "insert"}}
+        ]
+    
+    await db.user_actions.aggregate([
+        {"$match": {"verification_status": "approved"}},
+        *ledger_stages(
+            "action", "$id", "$points_earned",
+            {"$ifNull": ["$verified_at", "$created_at"]}, "$month_year"
+        )
+    ]).to_list(None)
+    
+    await db.user_missions.aggregate(ledger_stages(
+        "mission", {"$ifNull": ["$submission_id", "$id"]}, "$points_earned",
+        "$completed_at", "$month_year"
+    )).to_list(None)
+    
+    await db.quiz_completions.aggregate([
+        {"$match": {"points_earned": {"$gt": 0}}},
+        *ledger_stages(
+            "quiz", "$id", "$points_earned",
+            "$completed_at", {"$dateToString": {"format": "%Y-%m", "date": "$completed_at", "timezone": APP_TIMEZONE}}
+        )
+    ]).to_list(None)
+
+async def rebuild_score_rollup(collection_name: str):
+    """Rebuild one score rollup from the points ledger"""
+    bucket_fields = SCORE_ROLLUPS[collection_name]
+    await db[collection_name].delete_many({})
+    await db.points_ledger.aggregate([
+        {
+            "$group": {
+                "_id": {"user_id": "$user_id", **{field: f"${field}" for field in bucket_fields}},
+                "points": {"$sum": "$points"},
+                "last_award_at": {"$max": "$ts"}
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "user_id": "$_id.user_id",
+                **{field: f"$_id.{field}" for field in bucket_fields},
+                "points": 1,
+                "last_award_at": 1
+            }
+        },
+        {"$merge": {"into": collection_name, "on": ["user_id", *bucket_fields]}}
+    ]).to_list(None)
+
+# Authenticated users by id; handlers that change a user must invalidate its entry
+principal_cache = LRUCache(maxsize=10000, ttl=30)
+
+class ActivityTracker:
+    """Coalesces last-seen and daily-activity writes in memory and flushes them in bulk"""
+    
+    def __init__(self, flush_minutes: float):
+        self.flush_seconds = flush_minutes * 60
+        # user_id -> (latest seen at, days seen since the last flush)
+        self.pending: Dict[str, tuple] = {}
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.written = 0
+    
+    def touch(self, user_id: str):
+        entry = self.pending.get(user_id)
+        days = entry[1] if entry else set()
+        days.add(get_current_day())
+        self.pending[user_id] = (datetime.utcnow(), days)
+    
+    async def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        
+        stats_updates = []
+        activity_upserts = []
+        for user_id, (seen_at, days) in pending.items():
+            stats_updates.append(UpdateOne({"user_id": user_id}, {"$max": {"last_seen_at": seen_at}}))
+            for day in days:
+                activity_upserts.append(UpdateOne(
+                    {"day": day, "user_id": user_id},
+                    {"$setOnInsert": {"day": day, "user_id": user_id}},
+                    upsert=True
+                ))
+        
+        try:
+            await asyncio.gather(
+                db.user_stats.bulk_write(stats_updates, ordered=False),
+                db.daily_activity.bulk_write(activity_upserts, ordered=False)
+            )
+        except Exception:
+            # Both writes are idempotent, so the whole interval is simply retried on the next flush
+            self.restore(pending)
+            self.failed_flushes += 1
+            raise
+        self.flushes += 1
+        self.written += len(stats_updates)
+    
+    def restore(self, pending: Dict[str, tuple]):
+        """Merge an unwritten interval back into what has been touched since"""
+        for user_id, (seen_at, days) in pending.items():
+            entry = self.pending.get(user_id)
+            if entry:
+                self.pending[user_id] = (max(seen_at, entry[0]), days | entry[1])
+            else:
+                self.pending[user_id] = (seen_at, days)
+    
+    async def run(self):
+        """Background job: each user is written at most once per flush interval"""
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Failed to flush user activity: {str(e)}")
+    
+    def stats(self) -> dict:
+        return {
+            "flush_minutes": self.flush_seconds / 60,
+            "pending_users": len(self.pending),
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "users_written": self.written
+        }
+
+activity_tracker = ActivityTracker(flush_minutes=float(os.environ.get('ACTIVITY_FLUSH_MINUTES', 5)))
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials):
     try:
         token = credentials.credentials
@@ -516,59 +1880,116 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials):
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
         
-        user_data = await db.users.find_one({"id": user_id})
-        if user_data is None:
-            raise HTTPException(status_code=401, detail="User not found")
+        user = principal_cache.get(user_id)
+        if user is None:
+            user_data = await db.users.find_one({"id": user_id})
+            if user_data is None:
+                raise HTTPException(status_code=401, detail="User not found")
+            
+            user = User(**user_data)
+            principal_cache.put(user_id, user)
+        
+        # Tokens issued before claims were embedded carry no version and stay valid
+        if payload.get("ver", user.token_version) < user.token_version:
+            raise HTTPException(status_code=401, detail="Token revoked")
         
-        return User(**user_data)
+        activity_tracker.touch(user_id)
+        return user
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-def process_avatar_image(image_data: bytes) -> str:
-    """Process and resize avatar image to 400x400px"""
+# Latest token_version seen per user; a token older than this has been revoked
+token_versions: Dict[str, int] = {}
+
+async def load_token_versions():
+    """Seed the revocation table with every user whose tokens have ever been revoked"""
+    async for user_doc in db.users.find(
+        {"token_version": {"$gt": 0}}, {"_id": 0, "id": 1, "token_version": 1}
+    ):
+        token_versions[user_doc["id"]] = user_doc["token_version"]
+
+async def get_token_claims(credentials: HTTPAuthorizationCredentials = Depends(security)) -> TokenClaims:
+    """Authorize from the token's claims alone, reading the user only when revocation is suspected"""
     try:
-        img = Image.open(BytesIO(image_data))
-        img = img.convert('RGB')
-        img = img.resize((400, 400), Image.LANCZOS)
-        
-        buffer = BytesIO()
-        img.save(buffer, format='JPEG', quality=85)
-        img_str = base64.b64encode(buffer.getvalue()).decode()
-        return f"data:image/jpeg;base64,{img_str}"
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid image format")
+        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    user_id = payload.get("sub")
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    cached_user = principal_cache.get(user_id)
+    known_version = token_versions.get(user_id, cached_user.token_version if cached_user else None)
+    
+    # Tokens issued before claims were embedded carry no version and are checked against the user
+    if "ver" not in payload or (known_version is not None and payload["ver"] < known_version):
+        user = await get_current_user(credentials)
+        token_versions[user.id] = user.token_version
+        return TokenClaims(id=user.id, username=user.username, is_admin=user.is_admin, ver=user.token_version)
+    
+    activity_tracker.touch(user_id)
+    return TokenClaims(
+        id=user_id,
+        username=payload.get("username", ""),
+        is_admin=payload.get("is_admin", False),
+        ver=payload["ver"]
+    )
+
+async def get_admin_claims(credentials: HTTPAuthorizationCredentials = Depends(security)) -> TokenClaims:
+    claims = await get_token_claims(credentials)
+    if not claims.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return claims
+
+async def revoke_user_tokens(user_id: str) -> Optional[int]:
+    """Invalidate every token issued to a user so far"""
+    user_doc = await db.users.find_one_and_update(
+        {"id": user_id},
+        {"$inc": {"token_version": 1}},
+        projection={"_id": 0, "token_version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    principal_cache.invalidate(user_id)
+    if not user_doc:
+        return None
+    token_versions[user_id] = user_doc["token_version"]
+    return user_doc["token_version"]
 
 # === AUTHENTICATION ENDPOINTS ===
 
 @api_router.post("/auth/register")
 async def register_user(user_data: UserCreate):
-    # Check if user exists
-    existing_user = await db.users.find_one({"email": user_data.email})
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    existing_username = await db.users.find_one({"username": user_data.username})
-    if existing_username:
-        raise HTTPException(status_code=400, detail="Username already taken")
-    
-    # Create user
-    password_hash = get_password_hash(user_data.password)
+    # Create user; unique indexes on email, username and club_card_code reject duplicates
+    password_hash = await password_hasher.hash(user_data.password)
+    now = datetime.utcnow()
     user = User(
         name=user_data.name,
         username=user_data.username,
         email=user_data.email,
         password_hash=password_hash,
         country=user_data.country,
-        last_reset=datetime.utcnow()
+        last_reset=now,
+        created_at=now,
+        join_date=now
     )
+    user.club_card_qr_url = generate_club_card_qr_url(user.id)
+    user.club_card_code = await allocate_club_card_code()
     
-    await db.users.insert_one(user.dict())
+    try:
+        await db.users.insert_one(user.dict())
+    except DuplicateKeyError as e:
+        field = duplicate_key_field(e.details)
+        if field in DUPLICATE_USER_MESSAGES:
+            raise HTTPException(status_code=400, detail=DUPLICATE_USER_MESSAGES[field])
+        raise
     
-    # Initialize club card for new user
-    await initialize_club_card(user.id)
+    stats = UserStats(user_id=user.id, country=user.country)
+    await db.user_stats.insert_one(stats.dict())
+    remember_identity(user.username, user.email)
     
     # Create access token
-    access_token = create_access_token(data={"sub": user.id})
+    access_token = create_access_token(data=user_token_claims(user))
     
     return {
         "access_token": access_token,
@@ -579,20 +2000,45 @@ async def register_user(user_data: UserCreate):
             "username": user.username,
             "email": user.email,
             "country": user.country,
-            "current_points": user.current_points,
-            "level": user.level,
-            "avatar_url": user.avatar_url
+            "current_points": stats.current_points,
+            "level": stats.level,
+            "avatar_url": media_url(user.avatar_hash)
         }
     }
 
+@api_router.get("/auth/availability")
+async def check_availability(username: Optional[str] = None, email: Optional[str] = None):
+    """Live check for the registration form, answered from the Bloom filters where possible"""
+    if not username and not email:
+        raise HTTPException(status_code=400, detail="Provide username or email")
+    
+    result = {}
+    if username:
+        result["username"] = {"available": await identity_available("username", username, username_filter)}
+    if email:
+        result["email"] = {"available": await identity_available("email", normalize_email(email), email_filter)}
+    return result
+
 @api_router.post("/auth/login")
 async def login_user(user_data: UserLogin):
     user_doc = await db.users.find_one({"email": user_data.email})
-    if not user_doc or not verify_password(user_data.password, user_doc["password_hash"]):
+    if not user_doc:
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
+    (valid, new_hash), stats = await asyncio.gather(
+        password_hasher.verify_and_update(user_data.password, user_doc["password_hash"]),
+        get_user_stats(user_doc["id"])
+    )
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    
+    # Transparently move the stored hash to the configured bcrypt cost
+    if new_hash:
+        await db.users.update_one({"id": user_doc["id"]}, {"$set": {"password_hash": new_hash}})
+        user_doc["password_hash"] = new_hash
+    
     user = User(**user_doc)
-    access_token = create_access_token(data={"sub": user.id})
+    access_token = create_access_token(data=user_token_claims(user))
     
     return {
         "access_token": access_token,
@@ -603,10 +2049,10 @@ async def login_user(user_data: UserLogin):
             "username": user.username,
             "email": user.email,
             "country": user.country,
-            "current_points": user.current_points,
-            "total_points": user.total_points,
-            "level": user.level,
-            "avatar_url": user.avatar_url,
+            "current_points": stats.current_points,
+            "total_points": stats.total_points,
+            "level": stats.level,
+            "avatar_url": media_url(user.avatar_hash),
             "is_admin": user.is_admin
         }
     }
@@ -616,23 +2062,220 @@ async def upload_avatar(
     file: UploadFile = File(...),
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    current_user = await get_current_user(credentials)
+    current_user = await get_token_claims(credentials)
     
     # Validate file type
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
     
     # Process image
-    file_content = await file.read()
-    avatar_url = process_avatar_image(file_content)
+    try:
+        file_content = await read_upload_image(file)
+        avatar_image = await process_upload_image(file_content, AVATAR_IMAGE)
+    except InvalidImage:
+        raise HTTPException(status_code=400, detail="Invalid image format")
+    avatar_hash = await store_blob(avatar_image)
     
     # Update user
     await db.users.update_one(
         {"id": current_user.id},
-        {"$set": {"avatar_url": avatar_url}}
+        {"$set": {"avatar_hash": avatar_hash}}
+    )
+    principal_cache.invalidate(current_user.id)
+    
+    return {"avatar_url": media_url(avatar_hash)}
+
+@api_router.get("/users/{user_id}/avatar")
+async def get_user_avatar_thumbnail(user_id: str):
+    """Current avatar thumbnail of a user, for links that only know the user id"""
+    user_doc = await db.users.find_one({"id": user_id}, {"_id": 0, "avatar_hash": 1})
+    if not user_doc or not user_doc.get("avatar_hash"):
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    
+    return RedirectResponse(
+        media_url(user_doc["avatar_hash"], MEDIA_RENDITIONS["thumb"]),
+        headers={"Cache-Control": "public, max-age=300"}
+    )
+
+# === MEDIA ENDPOINTS ===
+
+@api_router.get("/media/{blob_hash}")
+async def get_media(blob_hash: str, request: Request, w: Optional[int] = Query(None, ge=1)):
+    """Serve a stored image, or with ?w= a resized rendition of it.
+
+    URLs change with the content, so clients may cache them forever. Renditions are
+    WebP for clients that accept it and JPEG otherwise.
+    """
+    if not re.fullmatch(r"[0-9a-f]{64}", blob_hash):
+        raise HTTPException(status_code=404, detail="Media not found")
+    
+    if w is None:
+        etag = f'"{blob_hash}"'
+        headers = {"ETag": etag, "Cache-Control": MEDIA_CACHE_CONTROL}
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        
+        data = await blob_store.get(blob_hash)
+        if data is None:
+            raise HTTPException(status_code=404, detail="Media not found")
+        return Response(content=data, media_type=sniff_image_type(data) or "application/octet-stream", headers=headers)
+    
+    width = rendition_width(w)
+    image_format = "webp" if WEBP_SUPPORTED and "image/webp" in request.headers.get("accept", "") else "jpeg"
+    name = f"{blob_hash}-{width}.{image_format}"
+    etag = f'"{name}"'
+    headers = {"ETag": etag, "Cache-Control": MEDIA_CACHE_CONTROL, "Vary": "Accept"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    
+    data = await rendition_cache.get(name)
+    if data is None:
+        original = await blob_store.get(blob_hash)
+        if original is None:
+            raise HTTPException(status_code=404, detail="Media not found")
+        
+        # One decode yields every rendition in this format; cache them all
+        try:
+            renditions = await image_processor.run(
+                render_renditions, original, list(MEDIA_RENDITIONS.values()), image_format.upper()
+            )
+        except InvalidImage:
+            raise HTTPException(status_code=404, detail="Media not found")
+        for rendition_size, rendition in renditions.items():
+            await rendition_cache.put(f"{blob_hash}-{rendition_size}.{image_format}", rendition)
+        data = renditions[width]
+    
+    return Response(content=data, media_type=f"image/{image_format}", headers=headers)
+
+# === UPLOADS ENDPOINTS ===
+# Resumable photo uploads: create one with its total size, PATCH chunks at Upload-Offset
+# (GET tells a client where to resume after a dropped connection), then finalize it and
+# pass its id as upload_id to a mission submission.
+
+def upload_status(upload: dict) -> dict:
+    return {
+        "upload_id": upload["id"],
+        "size": upload["size"],
+        "offset": upload["offset"],
+        "status": upload["status"],
+        "expires_at": upload["expires_at"]
+    }
+
+async def get_owned_upload(upload_id: str, user_id: str) -> dict:
+    upload = await db.uploads.find_one({"id": upload_id, "user_id": user_id}, {"_id": 0})
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+@api_router.post("/uploads", status_code=201)
+async def create_photo_upload(
+    upload_request: PhotoUploadRequest,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    current_user = await get_token_claims(credentials)
+    if upload_request.size <= 0:
+        raise HTTPException(status_code=400, detail="Upload size must be positive")
+    if upload_request.size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Upload too large")
+    
+    upload = PhotoUpload(
+        user_id=current_user.id,
+        size=upload_request.size,
+        expires_at=datetime.utcnow() + UPLOAD_EXPIRY
     )
+    await asyncio.to_thread(create_upload_part, upload.id)
+    await db.uploads.insert_one(upload.dict())
+    return upload_status(upload.dict())
+
+@api_router.get("/uploads/{upload_id}")
+async def get_photo_upload(
+    upload_id: str,
+    response: Response,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    current_user = await get_token_claims(credentials)
+    upload = await get_owned_upload(upload_id, current_user.id)
+    response.headers["Upload-Offset"] = str(upload["offset"])
+    return upload_status(upload)
+
+@api_router.patch("/uploads/{upload_id}", status_code=204)
+async def append_photo_upload(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(...),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    current_user = await get_token_claims(credentials)
+    if upload_id in uploads_receiving:
+        raise HTTPException(status_code=409, detail="Upload is already receiving a chunk")
     
-    return {"avatar_url": avatar_url}
+    uploads_receiving.add(upload_id)
+    try:
+        # Loaded only once no other chunk can be writing, so the offset is current
+        upload = await get_owned_upload(upload_id, current_user.id)
+        if upload["status"] != "open":
+            raise HTTPException(status_code=409, detail="Upload already finalized")
+        if upload_offset != upload["offset"]:
+            raise HTTPException(
+                status_code=409,
+                detail="Upload-Offset does not match the bytes received",
+                headers={"Upload-Offset": str(upload["offset"])}
+            )
+        try:
+            written = await receive_upload_chunk(upload, request)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Upload expired")
+        
+        new_offset = upload_offset + written
+        await db.uploads.update_one(
+            {"id": upload_id},
+            {"$set": {"offset": new_offset, "expires_at": datetime.utcnow() + UPLOAD_EXPIRY}}
+        )
+    finally:
+        uploads_receiving.discard(upload_id)
+    
+    return Response(status_code=204, headers={"Upload-Offset": str(new_offset)})
+
+@api_router.post("/uploads/{upload_id}/finalize")
+async def finalize_photo_upload(
+    upload_id: str,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    current_user = await get_token_claims(credentials)
+    upload = await get_owned_upload(upload_id, current_user.id)
+    # Finalizing twice is fine, for clients that never saw the first response
+    if upload["status"] == "complete":
+        return upload_status(upload)
+    if upload["offset"] < upload["size"]:
+        raise HTTPException(
+            status_code=409,
+            detail="Upload is incomplete",
+            headers={"Upload-Offset": str(upload["offset"])}
+        )
+    
+    try:
+        image_data = await asyncio.to_thread(read_upload_part, upload_id)
+        photo_image = await process_upload_image(image_data, MISSION_PHOTO)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload expired")
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=f"Invalid photo format: {str(e)}")
+    photo_hash = await store_blob(photo_image)
+    
+    upload = await db.uploads.find_one_and_update(
+        {"id": upload_id},
+        {"$set": {
+            "status": "complete",
+            "photo_hash": photo_hash,
+            "expires_at": datetime.utcnow() + UPLOAD_EXPIRY
+        }},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    await asyncio.to_thread(upload_part_path(upload_id).unlink, missing_ok=True)
+    return upload_status(upload)
 
 # === USER ENDPOINTS ===
 
@@ -641,20 +2284,16 @@ async def get_user_profile(credentials: HTTPAuthorizationCredentials = Depends(s
     current_user = await get_current_user(credentials)
     
     # Get user's position in current leaderboard
-    leaderboard = await db.leaderboards.find(
-        {"month_year": get_current_month_year()}
-    ).sort("points", -1).to_list(1000)
-    
-    position = 0
-    for i, entry in enumerate(leaderboard, 1):
-        if entry["user_id"] == current_user.id:
-            position = i
-            break
+    ranking = await get_leaderboard_ranking()
+    position = ranking.rank(current_user.id) or 0
     
     # Get user notifications
-    notifications = await db.notifications.find(
-        {"user_id": current_user.id, "read": False}
-    ).sort("created_at", -1).limit(5).to_list(5)
+    notifications, stats = await asyncio.gather(
+        db.notifications.find(
+            {"user_id": current_user.id, "read": False}
+        ).sort("created_at", -1).limit(5).to_list(5),
+        get_user_stats(current_user.id)
+    )
     
     return {
         "id": current_user.id,
@@ -662,10 +2301,10 @@ async def get_user_profile(credentials: HTTPAuthorizationCredentials = Depends(s
         "username": current_user.username,
         "email": current_user.email,
         "country": current_user.country,
-        "current_points": current_user.current_points,
-        "total_points": current_user.total_points,
-        "level": current_user.level,
-        "avatar_url": current_user.avatar_url,
+        "current_points": stats.current_points,
+        "total_points": stats.total_points,
+        "level": stats.level,
+        "avatar_url": media_url(current_user.avatar_hash),
         "position": position,
         "badges": current_user.badges,
         "unread_notifications": len(notifications),
@@ -679,22 +2318,28 @@ async def update_user_profile(
     country: Optional[str] = None,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    current_user = await get_current_user(credentials)
+    current_user = await get_token_claims(credentials)
     update_data = {}
     
     if name:
         update_data["name"] = name
     if username:
-        # Check if username is taken
-        existing = await db.users.find_one({"username": username, "id": {"$ne": current_user.id}})
-        if existing:
-            raise HTTPException(status_code=400, detail="Username already taken")
         update_data["username"] = username
     if country:
         update_data["country"] = country
     
     if update_data:
-        await db.users.update_one({"id": current_user.id}, {"$set": update_data})
+        try:
+            await db.users.update_one({"id": current_user.id}, {"$set": update_data})
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail="Username already taken")
+        principal_cache.invalidate(current_user.id)
+        remember_identity(username=username)
+    
+    if country:
+        await db.user_stats.update_one({"user_id": current_user.id}, {"$set": {"country": country}})
+        ranking = await get_leaderboard_ranking()
+        ranking.set_attributes(current_user.id, country=country)
     
     return {"message": "Profile updated successfully"}
 
@@ -786,7 +2431,7 @@ async def submit_action(
     submission_url: Optional[str] = Form(None),
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    current_user = await get_current_user(credentials)
+    current_user = await get_token_claims(credentials)
     month_year = get_current_month_year()
     
     # Get action type info
@@ -857,7 +2502,7 @@ async def get_action_history(
     limit: int = 20,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    current_user = await get_current_user(credentials)
+    current_user = await get_token_claims(credentials)
     
     actions = await db.user_actions.find(
         {"user_id": current_user.id}
@@ -883,53 +2528,270 @@ async def get_action_history(
     
     return clean_actions
 
-# === LEADERBOARD ENDPOINTS ===
+# === LEADERBOARD ENDPOINTS ===
+
+# Only the fields the leaderboard renders
+LEADERBOARD_USER_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "username": 1,
+    "name": 1,
+    "country": 1,
+    "avatar_hash": 1
+}
+
+def leaderboard_entry(position: int, points: int, user_doc: dict, level: str) -> dict:
+    return {
+        "position": position,
+        "user_id": user_doc["id"],
+        "username": user_doc["username"],
+        "name": user_doc["name"],
+        "avatar_url": media_url(user_doc.get("avatar_hash"), MEDIA_RENDITIONS["thumb"]),
+        "country": user_doc["country"],
+        "points": points,
+        "level": level
+    }
+
+async def run_leaderboard_pipeline(collection, stages: List[dict], limit: int = 50) -> List[dict]:
+    """Sort score rows produced by stages and join slim user fields in the same pipeline"""
+    rows = await collection.aggregate(stages + [
+        {"$sort": dict(LEADERBOARD_SORT)},
+        {"$limit": limit},
+        {
+            "$lookup": {
+                "from": "users",
+                "localField": "user_id",
+                "foreignField": "id",
+                "pipeline": [{"$project": LEADERBOARD_USER_PROJECTION}],
+                "as": "user"
+            }
+        },
+        {"$unwind": "$user"},
+        {
+            "$lookup": {
+                "from": "user_stats",
+                "localField": "user_id",
+                "foreignField": "user_id",
+                "pipeline": [{"$project": {"_id": 0, "level": 1}}],
+                "as": "stats"
+            }
+        },
+        {"$project": {"_id": 0, "points": 1, "user": 1, "level": {"$ifNull": [{"$first": "$stats.level"}, USER_LEVELS[-1][1]]}}}
+    ]).to_list(limit)
+    
+    return [leaderboard_entry(i, row["points"], row["user"], row["level"]) for i, row in enumerate(rows, 1)]
+
+async def build_leaderboard(month_year: str, limit: int = 50) -> List[dict]:
+    """Top scores for a month"""
+    return await run_leaderboard_pipeline(db.monthly_scores, [{"$match": {"month_year": month_year}}], limit)
+
+async def build_window_leaderboard(days: List[str], limit: int = 50) -> List[dict]:
+    """Top scores over a handful of daily buckets"""
+    return await run_leaderboard_pipeline(db.daily_scores, [
+        {"$match": {"day": {"$in": days}}},
+        {
+            "$group": {
+                "_id": "$user_id",
+                "points": {"$sum": "$points"},
+                "last_award_at": {"$max": "$last_award_at"}
+            }
+        },
+        {"$project": {"_id": 0, "user_id": "$_id", "points": 1, "last_award_at": 1}}
+    ], limit)
+
+# Past months stay open this many days into the next one so pending approvals can land
+LEADERBOARD_CLOSE_GRACE_DAYS = int(os.environ.get('LEADERBOARD_CLOSE_GRACE_DAYS', 7))
+
+# Closed months never change, so their snapshots are cached for the life of the process
+leaderboard_snapshot_cache = LRUCache(maxsize=24)
+
+async def get_leaderboard_snapshot(month_year: str) -> Optional[dict]:
+    """The frozen leaderboard of a closed month, or None while the month is still open"""
+    snapshot = leaderboard_snapshot_cache.get(month_year)
+    if snapshot is None:
+        snapshot = await db.leaderboard_snapshots.find_one({"month_year": month_year}, {"_id": 0})
+        if snapshot:
+            leaderboard_snapshot_cache.put(month_year, snapshot)
+    return snapshot
+
+async def count_pending_awards(month_year: str) -> int:
+    """Actions and mission submissions of a month still waiting for an admin decision"""
+    pending = {"month_year": month_year, "verification_status": "pending"}
+    actions, submissions = await asyncio.gather(
+        db.user_actions.count_documents(pending),
+        db.mission_submissions.count_documents(pending)
+    )
+    return actions + submissions
+
+# Months whose leaderboard is frozen or being frozen; approvals into them are refused
+closed_leaderboard_months = set()
+
+async def load_closed_leaderboard_months():
+    closed_leaderboard_months.update(await db.leaderboard_snapshots.distinct("month_year"))
+
+def open_month_filter() -> dict:
+    """Filter clause keeping an approval out of closed months, so the check costs no extra query"""
+    if not closed_leaderboard_months:
+        return {}
+    return {"month_year": {"$nin": sorted(closed_leaderboard_months)}}
+
+def month_closed_error(month_year: str) -> HTTPException:
+    return HTTPException(
+        status_code=409,
+        detail=f"The {month_year} leaderboard is closed; its pending awards can only be rejected"
+    )
+
+async def close_leaderboard_month(month_year: str) -> dict:
+    """Freeze a finished month's leaderboard into an immutable snapshot document"""
+    snapshot = await get_leaderboard_snapshot(month_year)
+    if snapshot:
+        closed_leaderboard_months.add(month_year)
+        return snapshot
+    
+    # Refuse approvals into the month before reading its scores, not after
+    closed_leaderboard_months.add(month_year)
+    try:
+        leaderboard = await build_leaderboard(month_year)
+        snapshot = {
+            "month_year": month_year,
+            "leaderboard": leaderboard,
+            "total_participants": len(leaderboard),
+            "closed_at": datetime.utcnow()
+        }
+        
+        try:
+            await db.leaderboard_snapshots.insert_one(dict(snapshot))
+        except DuplicateKeyError:
+            # Another request closed the month first; keep the stored snapshot
+            snapshot = await db.leaderboard_snapshots.find_one({"month_year": month_year}, {"_id": 0})
+    except Exception:
+        closed_leaderboard_months.discard(month_year)
+        raise
+    
+    leaderboard_snapshot_cache.put(month_year, snapshot)
+    return snapshot
+
+def get_previous_month_year() -> str:
+    first_of_month = local_now().date().replace(day=1)
+    return (first_of_month - timedelta(days=1)).strftime("%Y-%m")
+
+async def run_leaderboard_closing():
+    """Background job: close last month's leaderboard once its grace period is over"""
+    while True:
+        try:
+            month_year = get_previous_month_year()
+            if local_now().day > LEADERBOARD_CLOSE_GRACE_DAYS and not await get_leaderboard_snapshot(month_year):
+                pending = await count_pending_awards(month_year)
+                if pending:
+                    logging.warning(f"Closing the {month_year} leaderboard with {pending} awards still pending")
+                await close_leaderboard_month(month_year)
+        except Exception as e:
+            logging.error(f"Failed to close last month's leaderboard: {str(e)}")
+        await asyncio.sleep(3600)
+
+def parse_month_year(month_year: str) -> str:
+    try:
+        return datetime.strptime(month_year, "%Y-%m").strftime("%Y-%m")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="month_year must be in YYYY-MM format")
+
+async def join_leaderboard_users(entries: List[dict]) -> List[dict]:
+    """Attach slim user fields and levels to ranked entries with one $in query per collection"""
+    user_ids = [entry["user_id"] for entry in entries]
+    user_docs, stats = await asyncio.gather(
+        db.users.aggregate([
+            {"$match": {"id": {"$in": user_ids}}},
+            {"$project": LEADERBOARD_USER_PROJECTION}
+        ]).to_list(None),
+        get_user_stats_map(user_ids)
+    )
+    users_by_id = {user_doc["id"]: user_doc for user_doc in user_docs}
+    
+    return [
+        leaderboard_entry(entry["position"], entry["points"], users_by_id[entry["user_id"]], stats[entry["user_id"]].level)
+        for entry in entries
+        if entry["user_id"] in users_by_id
+    ]
 
 @api_router.get("/leaderboard")
-async def get_leaderboard(month_year: Optional[str] = None):
-    if not month_year:
-        month_year = get_current_month_year()
+async def get_leaderboard(
+    month_year: Optional[str] = None,
+    country: Optional[str] = None,
+    level: Optional[str] = None,
+    window: str = "monthly"
+):
+    if window not in ["weekly", "monthly", "alltime"]:
+        raise HTTPException(status_code=400, detail="Window must be 'weekly', 'monthly' or 'alltime'")
     
-    # Get top users for the month
-    pipeline = [
-        {
-            "$match": {
-                "month_year": month_year,
-                "verification_status": "approved"
-            }
-        },
-        {
-            "$group": {
-                "_id": "$user_id",
-                "total_points": {"$sum": "$points_earned"}
-            }
-        },
-        {
-            "$sort": {"total_points": -1}
-        },
-        {
-            "$limit": 50
+    if window == "weekly":
+        days = get_current_week_days()
+        leaderboard = await build_window_leaderboard(days)
+        return {
+            "window": window,
+            "week_start": days[0],
+            "leaderboard": leaderboard,
+            "total_participants": len(leaderboard)
         }
-    ]
     
-    leaderboard_data = await db.user_actions.aggregate(pipeline).to_list(50)
+    if window == "alltime":
+        leaderboard = await run_leaderboard_pipeline(db.alltime_scores, [])
+        return {
+            "window": window,
+            "leaderboard": leaderboard,
+            "total_participants": len(leaderboard)
+        }
     
-    # Get user details and create leaderboard
-    leaderboard = []
-    for i, entry in enumerate(leaderboard_data, 1):
-        user_doc = await db.users.find_one({"id": entry["_id"]})
-        if user_doc:
-            user = User(**user_doc)
-            leaderboard.append({
-                "position": i,
-                "user_id": user.id,
-                "username": user.username,
-                "name": user.name,
-                "avatar_url": user.avatar_url,
-                "country": user.country,
-                "points": entry["total_points"],
-                "level": get_user_level(user.total_points)
-            })
+    current_month = get_current_month_year()
+    if not month_year:
+        month_year = current_month
+    month_year = parse_month_year(month_year)
+    
+    if country or level:
+        if level and level not in [name for _, name in USER_LEVELS]:
+            raise HTTPException(status_code=400, detail="Unknown level")
+        if month_year != current_month:
+            raise HTTPException(status_code=400, detail="Country and level views are only available for the current month")
+        
+        ranking = await get_leaderboard_ranking()
+        partition = ranking.partition_key(country=country, level=level)
+        leaderboard = await join_leaderboard_users(ranking.top(50, partition))
+        
+        return {
+            "month_year": month_year,
+            "country": country,
+            "level": level,
+            "leaderboard": leaderboard,
+            "total_participants": len(ranking.partition(partition))
+        }
+    
+    if month_year < current_month:
+        snapshot = await get_leaderboard_snapshot(month_year)
+        if snapshot:
+            return JSONResponse(
+                content={
+                    "month_year": month_year,
+                    "closed": True,
+                    "leaderboard": snapshot["leaderboard"],
+                    "total_participants": snapshot["total_participants"]
+                },
+                headers={"Cache-Control": "public, max-age=31536000, immutable"}
+            )
+        
+        # Late approvals can still change a month that has not been closed yet
+        leaderboard = await build_leaderboard(month_year)
+        return JSONResponse(
+            content={
+                "month_year": month_year,
+                "closed": False,
+                "leaderboard": leaderboard,
+                "total_participants": len(leaderboard)
+            },
+            headers={"Cache-Control": "public, max-age=300"}
+        )
+    
+    leaderboard = await build_leaderboard(month_year)
+    for entry in leaderboard:
+        entry["rank_delta"] = rank_history.delta(entry["user_id"], entry["position"])
     
     return {
         "month_year": month_year,
@@ -937,6 +2799,69 @@ async def get_leaderboard(month_year: Optional[str] = None):
         "total_participants": len(leaderboard)
     }
 
+@api_router.get("/leaderboard/stream")
+async def stream_leaderboard(request: Request):
+    """Server-sent events with coalesced rank changes for the current month"""
+    ranking = await get_leaderboard_ranking()
+    if leaderboard_broadcaster.month_year is None:
+        leaderboard_broadcaster.month_year = ranking.month_year
+        leaderboard_broadcaster.last_sent = {
+            entry["user_id"]: (entry["position"], entry["points"])
+            for entry in ranking.top(leaderboard_broadcaster.top_n)
+        }
+    queue = leaderboard_broadcaster.subscribe()
+    
+    async def events():
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            leaderboard_broadcaster.unsubscribe(queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/leaderboard/rank/{user_id}")
+async def get_leaderboard_rank(user_id: str):
+    """Current month's rank and points for a single user"""
+    ranking = await get_leaderboard_ranking()
+    
+    return {
+        "month_year": ranking.month_year,
+        "user_id": user_id,
+        "position": ranking.rank(user_id),
+        "points": ranking.points(user_id),
+        "total_participants": len(ranking.index)
+    }
+
+@api_router.get("/leaderboard/around/{user_id}")
+async def get_leaderboard_around(user_id: str, radius: int = Query(5, ge=1, le=25)):
+    """Leaderboard slice centred on a user for the current month"""
+    ranking = await get_leaderboard_ranking()
+    entries = ranking.around(user_id, radius)
+    if not entries:
+        raise HTTPException(status_code=404, detail="User not ranked this month")
+    
+    leaderboard = await join_leaderboard_users(entries)
+    for entry in leaderboard:
+        entry["rank_delta"] = rank_history.delta(entry["user_id"], entry["position"])
+    
+    return {
+        "month_year": ranking.month_year,
+        "user_id": user_id,
+        "position": ranking.rank(user_id),
+        "leaderboard": leaderboard
+    }
+
 # === MISSIONS ENDPOINTS ===
 
 @api_router.get("/missions")
@@ -944,7 +2869,7 @@ async def get_missions(
     month_year: Optional[str] = None,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    current_user = await get_current_user(credentials)
+    current_user = await get_token_claims(credentials)
     
     if not month_year:
         month_year = get_current_month_year()
@@ -970,7 +2895,7 @@ async def get_missions(
     submitted_mission_ids = {sub["mission_id"]: sub for sub in user_submissions}
     
     # Get today's date for daily limit checking
-    today = datetime.now().date()
+    today = local_now().date()
     week_start = today - timedelta(days=today.weekday())
     
     enhanced_missions = []
@@ -1050,9 +2975,10 @@ async def submit_mission(
     description: str = Form(...),
     submission_url: Optional[str] = Form(None),
     photo: Optional[UploadFile] = File(None),
+    upload_id: Optional[str] = Form(None),
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    current_user = await get_current_user(credentials)
+    current_user = await get_token_claims(credentials)
     
     # Get mission details
     mission = await db.missions.find_one({"id": mission_id, "is_active": True})
@@ -1063,7 +2989,7 @@ async def submit_mission(
     month_year = get_current_month_year()
     
     # Check if user can submit this mission based on frequency and limits
-    today = datetime.now().date()
+    today = local_now().date()
     
     if frequency == "one-time":
         # Check if already submitted/completed
@@ -1107,39 +3033,30 @@ async def submit_mission(
     if mission.get("requires_description", True) and not description.strip():
         raise HTTPException(status_code=400, detail="Description is required for this mission")
     
-    if mission.get("requires_photo", False) and not photo:
+    if mission.get("requires_photo", False) and not photo and not upload_id:
         raise HTTPException(status_code=400, detail="Photo is required for this mission")
     
     if mission.get("requires_link", False) and not submission_url:
         raise HTTPException(status_code=400, detail="Link is required for this mission")
     
     # Handle photo upload if provided
-    photo_url = None
+    photo_hash = None
     if photo:
         try:
-            # Resize and save photo (reusing existing logic)
-            image_data = await photo.read()
-            image = Image.open(BytesIO(image_data))
-            
-            # Resize to reasonable size
-            max_size = (800, 600)
-            image.thumbnail(max_size, Image.LANCZOS)
-            
-            # Convert to RGB if necessary
-            if image.mode in ('RGBA', 'LA', 'P'):
-                background = Image.new('RGB', image.size, (255, 255, 255))
-                if image.mode == 'P':
-                    image = image.convert('RGBA')
-                background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-                image = background
-            
-            # Save as base64
-            output = BytesIO()
-            image.save(output, format='JPEG', quality=85)
-            photo_url = base64.b64encode(output.getvalue()).decode()
-            
-        except Exception as e:
+            image_data = await read_upload_image(photo)
+            photo_image = await process_upload_image(image_data, MISSION_PHOTO)
+        except InvalidImage as e:
             raise HTTPException(status_code=400, detail=f"Invalid photo format: {str(e)}")
+        photo_hash = await store_blob(photo_image)
+    elif upload_id:
+        # A photo sent ahead through a resumable upload was already processed when finalized
+        upload = await db.uploads.find_one(
+            {"id": upload_id, "user_id": current_user.id, "status": "complete"},
+            {"_id": 0, "photo_hash": 1}
+        )
+        if not upload:
+            raise HTTPException(status_code=400, detail="Photo upload not found or not finalized")
+        photo_hash = upload["photo_hash"]
     
     # Create mission submission
     submission = MissionSubmission(
@@ -1147,7 +3064,7 @@ async def submit_mission(
         mission_id=mission_id,
         mission_title=mission["title"],
         description=description,
-        photo_url=photo_url,
+        photo_hash=photo_hash,
         submission_url=submission_url,
         points_earned=mission["points"],
         month_year=month_year,
@@ -1170,10 +3087,7 @@ async def submit_mission(
         await db.user_missions.insert_one(user_mission.dict())
         
         # Update user's total points
-        await db.users.update_one(
-            {"id": current_user.id},
-            {"$inc": {"total_points": mission["points"], "current_points": mission["points"]}}
-        )
+        await award_points(current_user.id, mission["points"], month_year, "mission", submission.id)
         
         # Create notification
         notification = Notification(
@@ -1235,7 +3149,9 @@ async def get_prizes(month_year: Optional[str] = None):
     ]
     
     # Try to get custom prizes first
-    prizes = await db.prizes.find({"month_year": month_year}).to_list(10)
+    prizes = await db.prizes.find({"month_year": month_year}, {"_id": 0}).to_list(10)
+    for prize in prizes:
+        prize["image_url"] = media_url(prize.pop("image_hash", None))
     
     # If no custom prizes, return defaults
     if not prizes:
@@ -1243,16 +3159,11 @@ async def get_prizes(month_year: Optional[str] = None):
     
     return prizes
 
-@api_router.get("/admin/prizes")
+@api_router.get("/admin/prizes", dependencies=[Depends(get_admin_claims)])
 async def get_admin_prizes(
-    month_year: Optional[str] = None,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    month_year: Optional[str] = None
 ):
     """Get prizes with admin info for current month"""
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     if not month_year:
         month_year = get_current_month_year()
     
@@ -1301,7 +3212,7 @@ async def get_admin_prizes(
                 "position": position,
                 "title": custom_prize["title"],
                 "description": custom_prize["description"],
-                "image_url": custom_prize.get("image_url"),
+                "image_url": media_url(custom_prize.get("image_hash")),
                 "month_year": month_year,
                 "is_custom": True
             })
@@ -1310,17 +3221,12 @@ async def get_admin_prizes(
     
     return result_prizes
 
-@api_router.put("/admin/prizes/{position}")
+@api_router.put("/admin/prizes/{position}", dependencies=[Depends(get_admin_claims)])
 async def update_prize(
     position: int,
-    update_request: PrizeUpdateRequest,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    update_request: PrizeUpdateRequest
 ):
     """Update or create custom prize for specific position"""
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     if position not in [1, 2, 3]:
         raise HTTPException(status_code=400, detail="Position must be 1, 2, or 3")
     
@@ -1337,7 +3243,7 @@ async def update_prize(
         update_data = {}
         if update_request.title: update_data["title"] = update_request.title
         if update_request.description: update_data["description"] = update_request.description  
-        if update_request.image_url is not None: update_data["image_url"] = update_request.image_url
+        if update_request.image_hash is not None: update_data["image_hash"] = update_request.image_hash
         
         await db.prizes.update_one(
             {"id": existing_prize["id"]},
@@ -1349,23 +3255,18 @@ async def update_prize(
             position=position,
             title=update_request.title or f"Premio {position}° posto",
             description=update_request.description or "Descrizione premio personalizzato",
-            image_url=update_request.image_url,
+            image_hash=update_request.image_hash,
             month_year=month_year
         )
         await db.prizes.insert_one(prize.dict())
     
     return {"message": f"🌿 Premio {position}° posto aggiornato con successo!"}
 
-@api_router.delete("/admin/prizes/{position}")
+@api_router.delete("/admin/prizes/{position}", dependencies=[Depends(get_admin_claims)])
 async def restore_default_prize(
-    position: int,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    position: int
 ):
     """Restore prize to default values"""
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     if position not in [1, 2, 3]:
         raise HTTPException(status_code=400, detail="Position must be 1, 2, or 3")
     
@@ -1379,42 +3280,19 @@ async def restore_default_prize(
     
     return {"message": f"⚙️ Premio {position}° posto ripristinato ai valori predefiniti!"}
 
-@api_router.post("/admin/prizes/upload-image")
+@api_router.post("/admin/prizes/upload-image", dependencies=[Depends(get_admin_claims)])
 async def upload_prize_image(
-    photo: UploadFile = File(...),
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    photo: UploadFile = File(...)
 ):
     """Upload image for prize"""
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     try:
-        # Process image similar to avatar upload
-        image_data = await photo.read()
-        image = Image.open(BytesIO(image_data))
-        
-        # Resize to appropriate size for prizes
-        max_size = (400, 300)
-        image.thumbnail(max_size, Image.LANCZOS)
-        
-        # Convert to RGB if necessary
-        if image.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', image.size, (255, 255, 255))
-            if image.mode == 'P':
-                image = image.convert('RGBA')
-            background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-            image = background
-        
-        # Save as base64
-        output = BytesIO()
-        image.save(output, format='JPEG', quality=90)
-        image_url = base64.b64encode(output.getvalue()).decode()
-        
-        return {"image_url": image_url, "message": "Immagine caricata con successo!"}
-        
-    except Exception as e:
+        image_data = await read_upload_image(photo)
+        prize_image = await process_upload_image(image_data, PRIZE_IMAGE)
+    except InvalidImage as e:
         raise HTTPException(status_code=400, detail=f"Errore nel caricamento dell'immagine: {str(e)}")
+    
+    image_hash = await store_blob(prize_image)
+    return {"image_hash": image_hash, "image_url": media_url(image_hash), "message": "Immagine caricata con successo!"}
 
 # === CLUB CARD ENDPOINTS ===
 
@@ -1429,7 +3307,10 @@ async def get_club_card(
     await initialize_club_card(current_user.id)
     
     # Refresh user data
-    user_doc = await db.users.find_one({"id": current_user.id})
+    user_doc, stats = await asyncio.gather(
+        db.users.find_one({"id": current_user.id}),
+        get_user_stats(current_user.id)
+    )
     if not user_doc:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -1442,6 +3323,7 @@ async def get_club_card(
             {"id": current_user.id},
             {"$set": {"club_card_qr_url": updated_qr_url}}
         )
+        principal_cache.invalidate(current_user.id)
         current_user.club_card_qr_url = updated_qr_url
     
     return {
@@ -1450,9 +3332,9 @@ async def get_club_card(
         "club_card_code": user.club_card_code,
         "club_card_qr_url": user.club_card_qr_url,
         "join_date": user.join_date.isoformat() if user.join_date else None,
-        "level": get_user_level(user.total_points),
-        "total_points": user.total_points,
-        "avatar_url": user.avatar_url
+        "level": stats.level,
+        "total_points": stats.total_points,
+        "avatar_url": media_url(user.avatar_hash)
     }
 
 @api_router.get("/club-card/qr/{user_id}")
@@ -1463,7 +3345,10 @@ async def get_user_profile_by_qr(user_id: str):
 @api_router.get("/club/profile/{user_id}")
 async def get_public_user_profile(user_id: str):
     """Enhanced public profile for QR code access with dynamic content"""
-    user_doc = await db.users.find_one({"id": user_id})
+    user_doc, stats = await asyncio.gather(
+        db.users.find_one({"id": user_id}),
+        get_user_stats(user_id)
+    )
     if not user_doc:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -1471,16 +3356,10 @@ async def get_public_user_profile(user_id: str):
     current_month = get_current_month_year()
     
     # Get current leaderboard to determine user's rank
-    leaderboard = await db.users.find(
-        {"current_points": {"$gt": 0}},
-        {"id": 1, "name": 1, "current_points": 1}
-    ).sort("current_points", -1).to_list(None)
-    
-    user_rank = None
-    for idx, user_entry in enumerate(leaderboard):
-        if user_entry["id"] == user_id:
-            user_rank = idx + 1
-            break
+    ranking = await get_leaderboard_ranking()
+    user_rank = ranking.rank(user_id)
+    # The rank is this month's, so the points quoted next to it must be too
+    monthly_points = ranking.points(user_id)
     
     # Get user's mission completions count
     mission_completions = await db.user_missions.count_documents({
@@ -1535,11 +3414,17 @@ async def get_public_user_profile(user_id: str):
             "message_en": f"🏆 Congratulations! You're in the Top 3 for {current_month}.",
             "prize_info": current_prize
         }
-    elif user_rank and user.current_points > 0:
+    elif user_rank and monthly_points > 0:
         status_message = {
             "type": "active",
-            "message_it": f"🌿 Attualmente sei al posto #{user_rank} con {user.current_points} punti.",
-            "message_en": f"🌿 Currently you're at position #{user_rank} with {user.current_points} points."
+            "message_it": f"🌿 Attualmente sei al posto #{user_rank} con {monthly_points} punti questo mese.",
+            "message_en": f"🌿 Currently you're at position #{user_rank} with {monthly_points} points this month."
+        }
+    elif stats.total_points > 0:
+        status_message = {
+            "type": "inactive",
+            "message_it": "🌿 Nessun punto questo mese: partecipa per tornare in classifica!",
+            "message_en": "🌿 No points yet this month: take part to get back on the leaderboard!"
         }
     else:
         status_message = {
@@ -1552,15 +3437,17 @@ async def get_public_user_profile(user_id: str):
         "user_info": {
             "name": user.name,
             "username": user.username,
-            "level": get_user_level(user.total_points),
-            "avatar_url": user.avatar_url,
+            "level": stats.level,
+            "avatar_url": media_url(user.avatar_hash),
             "club_card_code": user.club_card_code,
             "join_date": user.join_date.isoformat() if user.join_date else None
         },
         "stats": {
-            "total_points": user.total_points,
-            "current_points": user.current_points,
+            "total_points": stats.total_points,
+            "current_points": stats.current_points,
+            "monthly_points": monthly_points,
             "current_rank": user_rank,
+            "rank_delta": rank_history.delta(user_id, user_rank),
             "mission_completions": mission_completions,
             "month_year": current_month
         },
@@ -1605,7 +3492,7 @@ async def update_user_language(
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
     """Update user's preferred language"""
-    current_user = await get_current_user(credentials)
+    current_user = await get_token_claims(credentials)
     
     if language not in ["it", "en"]:
         raise HTTPException(status_code=400, detail="Language must be 'it' or 'en'")
@@ -1614,35 +3501,25 @@ async def update_user_language(
         {"id": current_user.id},
         {"$set": {"preferred_language": language}}
     )
+    principal_cache.invalidate(current_user.id)
     
     return {"message": f"🌿 Lingua aggiornata: {'Italiano' if language == 'it' else 'English'}"}
 
-@api_router.get("/admin/translations")
-async def get_admin_translations(
-    credentials: HTTPAuthorizationCredentials = Depends(security)
-):
+@api_router.get("/admin/translations", dependencies=[Depends(get_admin_claims)])
+async def get_admin_translations():
     """Get all translations for admin management"""
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     translations = await db.translations.find({}).to_list(None)
     
     return translations
 
-@api_router.post("/admin/translations")
+@api_router.post("/admin/translations", dependencies=[Depends(get_admin_claims)])
 async def create_translation(
     key: str = Query(...),
     italian: str = Query(...),
     english: str = Query(...),
-    category: str = Query("general"),
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    category: str = Query("general")
 ):
     """Create or update translation"""
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     # Check if translation key already exists
     existing = await db.translations.find_one({"key": key})
     
@@ -1738,7 +3615,7 @@ async def get_notifications(
     limit: int = 20,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    current_user = await get_current_user(credentials)
+    current_user = await get_token_claims(credentials)
     
     notifications = await db.notifications.find(
         {"user_id": current_user.id}
@@ -1765,7 +3642,7 @@ async def mark_notification_read(
     notification_id: str,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    current_user = await get_current_user(credentials)
+    current_user = await get_token_claims(credentials)
     
     await db.notifications.update_one(
         {"id": notification_id, "user_id": current_user.id},
@@ -1776,12 +3653,35 @@ async def mark_notification_read(
 
 # === ADMIN ENDPOINTS ===
 
-@api_router.get("/admin/actions/pending")
-async def get_pending_actions(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
+@api_router.post("/admin/leaderboard/{month_year}/close", dependencies=[Depends(get_admin_claims)])
+async def close_leaderboard(
+    month_year: str,
+    force: bool = False
+):
+    """Freeze the leaderboard of a finished month"""
+    month_year = parse_month_year(month_year)
+    if month_year >= get_current_month_year():
+        raise HTTPException(status_code=400, detail="Only past months can be closed")
+    
+    # Closing is final, so awards still waiting for a decision must be handled first
+    pending = await count_pending_awards(month_year)
+    if pending and not force and not await get_leaderboard_snapshot(month_year):
+        raise HTTPException(
+            status_code=409,
+            detail=f"{pending} actions or missions of {month_year} are still pending; decide them or pass force=true"
+        )
     
+    snapshot = await close_leaderboard_month(month_year)
+    
+    return {
+        "message": f"Classifica di {month_year} archiviata",
+        "month_year": month_year,
+        "total_participants": snapshot["total_participants"],
+        "closed_at": snapshot["closed_at"].isoformat()
+    }
+
+@api_router.get("/admin/actions/pending", dependencies=[Depends(get_admin_claims)])
+async def get_pending_actions():
     actions = await db.user_actions.find(
         {"verification_status": "pending"}
     ).sort("created_at", -1).to_list(100)
@@ -1813,54 +3713,40 @@ async def get_pending_actions(credentials: HTTPAuthorizationCredentials = Depend
     
     return result
 
-@api_router.put("/admin/actions/{action_id}/verify")
+@api_router.put("/admin/actions/{action_id}/verify", dependencies=[Depends(get_admin_claims)])
 async def verify_action(
     action_id: str,
     status: str,  # approved or rejected
-    credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     if status not in ["approved", "rejected"]:
         raise HTTPException(status_code=400, detail="Status must be 'approved' or 'rejected'")
     
-    action_doc = await db.user_actions.find_one({"id": action_id})
-    if not action_doc:
-        raise HTTPException(status_code=404, detail="Action not found")
-    
-    # Update action status
-    await db.user_actions.update_one(
-        {"id": action_id},
+    # Only a pending action can be decided, so concurrent admins cannot approve it twice;
+    # approvals also skip months whose leaderboard is already closed
+    pending_filter = {"id": action_id, "verification_status": "pending"}
+    if status == "approved":
+        pending_filter.update(open_month_filter())
+    action_doc = await db.user_actions.find_one_and_update(
+        pending_filter,
         {
             "$set": {
                 "verification_status": status,
                 "verified_at": datetime.utcnow()
             }
-        }
+        },
+        return_document=ReturnDocument.AFTER
     )
+    if not action_doc:
+        existing = await db.user_actions.find_one({"id": action_id}, {"_id": 0, "verification_status": 1, "month_year": 1})
+        if not existing:
+            raise HTTPException(status_code=404, detail="Action not found")
+        if existing["verification_status"] == "pending":
+            raise month_closed_error(existing["month_year"])
+        raise HTTPException(status_code=400, detail="Action already processed")
     
     # If approved, add points to user
     if status == "approved":
-        await db.users.update_one(
-            {"id": action_doc["user_id"]},
-            {
-                "$inc": {
-                    "current_points": action_doc["points_earned"],
-                    "total_points": action_doc["points_earned"]
-                }
-            }
-        )
-        
-        # Update user level
-        user_doc = await db.users.find_one({"id": action_doc["user_id"]})
-        if user_doc:
-            new_level = get_user_level(user_doc["total_points"] + action_doc["points_earned"])
-            await db.users.update_one(
-                {"id": action_doc["user_id"]},
-                {"$set": {"level": new_level}}
-            )
+        await award_points(action_doc["user_id"], action_doc["points_earned"], action_doc["month_year"], "action", action_id)
         
         # Create success notification
         notification = Notification(
@@ -1889,9 +3775,19 @@ async def send_admin_email(
     email_request: EmailRequest,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
+    current_user = await get_admin_claims(credentials)
+    
+    # Points of the current 3rd place and each recipient's month, both from the ledger's materialization
+    month_year = get_current_month_year()
+    top3 = await db.monthly_scores.find(
+        {"month_year": month_year}
+    ).sort(LEADERBOARD_SORT).limit(3).to_list(3)
+    recipient_scores = await db.monthly_scores.find(
+        {"month_year": month_year, "user_id": {"$in": email_request.recipients}},
+        {"_id": 0, "user_id": 1, "points": 1}
+    ).to_list(None)
+    month_points = {score["user_id"]: score["points"] for score in recipient_scores}
+    recipient_stats = await get_user_stats_map(email_request.recipients)
     
     # Process template variables
     processed_recipients = []
@@ -1901,21 +3797,14 @@ async def send_admin_email(
             # Replace variables in email body
             user_body = email_request.body
             user_body = user_body.replace("{{user_name}}", user_doc["name"])
-            user_body = user_body.replace("{{user_points}}", str(user_doc["current_points"]))
-            user_body = user_body.replace("{{user_level}}", user_doc["level"])
+            user_body = user_body.replace("{{user_points}}", str(recipient_stats[recipient_id].current_points))
+            user_body = user_body.replace("{{user_level}}", recipient_stats[recipient_id].level)
             user_body = user_body.replace("{{month_theme}}", "Live Puglia Challenge")
             
             # Calculate points to top 3
-            leaderboard = await db.user_actions.aggregate([
-                {"$match": {"month_year": get_current_month_year(), "verification_status": "approved"}},
-                {"$group": {"_id": "$user_id", "total_points": {"$sum": "$points_earned"}}},
-                {"$sort": {"total_points": -1}},
-                {"$limit": 3}
-            ]).to_list(3)
-            
             points_to_top3 = 0
-            if len(leaderboard) >= 3:
-                points_to_top3 = max(0, leaderboard[2]["total_points"] - user_doc["current_points"] + 1)
+            if len(top3) >= 3:
+                points_to_top3 = max(0, top3[2]["points"] - month_points.get(recipient_id, 0) + 1)
             
             user_body = user_body.replace("{{points_to_top3}}", str(points_to_top3))
             
@@ -1958,15 +3847,10 @@ async def send_admin_email(
     else:
         return {"message": f"❌ Invio email fallito per tutti i {failed_count} destinatari. Controlla la configurazione SMTP."}
 
-@api_router.get("/admin/email/logs")
+@api_router.get("/admin/email/logs", dependencies=[Depends(get_admin_claims)])
 async def get_email_logs(
-    limit: int = 50,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    limit: int = 50
 ):
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     logs = await db.email_log.find().sort("sent_at", -1).limit(limit).to_list(limit)
     
     clean_logs = []
@@ -1983,16 +3867,11 @@ async def get_email_logs(
     
     return clean_logs
 
-@api_router.post("/admin/email/test")
+@api_router.post("/admin/email/test", dependencies=[Depends(get_admin_claims)])
 async def test_email_config(
-    test_email: str,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    test_email: str
 ):
     """Test email configuration by sending a test email"""
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     subject = "🌿 Test Email - Desideri di Puglia Club"
     body = """
     <html>
@@ -2012,50 +3891,196 @@ async def test_email_config(
     else:
         raise HTTPException(status_code=500, detail="Invio email fallito. Controlla la configurazione SMTP.")
 
-@api_router.get("/admin/users/list")
-async def get_users_for_email(
-    credentials: HTTPAuthorizationCredentials = Depends(security)
-):
+@api_router.get("/admin/users/list", dependencies=[Depends(get_admin_claims)])
+async def get_users_for_email():
     """Get list of users for email selection and admin statistics"""
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
-    users = await db.users.find(
-        {}, 
-        {
-            "id": 1, "name": 1, "email": 1, "username": 1, 
-            "current_points": 1, "total_points": 1, "level": 1, 
-            "join_date": 1, "created_at": 1
-        }
-    ).to_list(length=None)
+    users, stats_docs = await asyncio.gather(
+        db.users.find(
+            {}, 
+            {"id": 1, "name": 1, "email": 1, "username": 1, "join_date": 1, "created_at": 1}
+        ).to_list(length=None),
+        db.user_stats.find(
+            {},
+            {"_id": 0, "user_id": 1, "current_points": 1, "total_points": 1, "level": 1}
+        ).to_list(length=None)
+    )
+    stats_by_user = {stats_doc["user_id"]: stats_doc for stats_doc in stats_docs}
     
     user_list = []
     for user in users:
+        stats = stats_by_user.get(user["id"], {})
         user_list.append({
             "id": user["id"],
             "name": user["name"],
             "email": user["email"],
             "username": user.get("username", ""),
-            "current_points": user.get("current_points", 0),
-            "total_points": user.get("total_points", 0),
-            "level": user.get("level", "Explorer"),
+            "current_points": stats.get("current_points", 0),
+            "total_points": stats.get("total_points", 0),
+            "level": stats.get("level", "Explorer"),
             "join_date": user.get("join_date", user.get("created_at")).isoformat() if user.get("join_date") or user.get("created_at") else None
         })
     
     return user_list
 
+@api_router.post("/admin/users/{user_id}/revoke-tokens", dependencies=[Depends(get_admin_claims)])
+async def revoke_tokens(
+    user_id: str
+):
+    """Sign a user out everywhere by invalidating all their issued tokens"""
+    if await revoke_user_tokens(user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    return {"message": "Sessioni utente revocate"}
+
+USER_IMPORT_BATCH_SIZE = 1000
+
+def parse_user_import(content: bytes, filename: str) -> List[dict]:
+    """Rows of a CSV (with header) or NDJSON guest list"""
+    text = content.decode("utf-8-sig")
+    if filename.lower().endswith(".csv"):
+        return [dict(row) for row in csv.DictReader(StringIO(text))]
+    
+    rows = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            rows.append(json.loads(line))
+        except json.JSONDecodeError:
+            rows.append({})
+    return rows
+
+@api_router.post("/admin/users/import", dependencies=[Depends(get_admin_claims)])
+async def import_users(
+    file: UploadFile = File(...)
+):
+    """Create many users from a CSV or NDJSON file (name, username, email, password, country)"""
+    try:
+        rows = parse_user_import(await file.read(), file.filename or "")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded")
+    
+    failures = []
+    valid = []
+    for row_number, row in enumerate(rows, start=1):
+        try:
+            valid.append((row_number, UserCreate(**row)))
+        except ValidationError as e:
+            problems = "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+            failures.append({"row": row_number, "error": f"Invalid row: {problems}"})
+        except TypeError:
+            failures.append({"row": row_number, "error": "Invalid row"})
+    
+    password_hashes = await hash_passwords_parallel([user_data.password for _, user_data in valid])
+    club_card_codes = await allocate_club_card_codes(len(valid)) if valid else []
+    
+    now = datetime.utcnow()
+    documents = []
+    for (row_number, user_data), password_hash, club_card_code in zip(valid, password_hashes, club_card_codes):
+        user = User(
+            name=user_data.name,
+            username=user_data.username,
+            email=user_data.email,
+            password_hash=password_hash,
+            country=user_data.country,
+            last_reset=now,
+            created_at=now,
+            join_date=now,
+            club_card_code=club_card_code
+        )
+        user.club_card_qr_url = generate_club_card_qr_url(user.id)
+        documents.append((row_number, user.dict()))
+    
+    imported = 0
+    for start in range(0, len(documents), USER_IMPORT_BATCH_SIZE):
+        batch = documents[start:start + USER_IMPORT_BATCH_SIZE]
+        rejected = set()
+        try:
+            await db.users.insert_many([document for _, document in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                rejected.add(error["index"])
+                field = duplicate_key_field(error)
+                failures.append({
+                    "row": batch[error["index"]][0],
+                    "error": DUPLICATE_USER_MESSAGES.get(field, error.get("errmsg", "Insert failed"))
+                })
+        
+        inserted = [document for index, (_, document) in enumerate(batch) if index not in rejected]
+        if inserted:
+            await db.user_stats.insert_many(
+                [UserStats(user_id=document["id"], country=document["country"]).dict() for document in inserted],
+                ordered=False
+            )
+        for document in inserted:
+            remember_identity(document["username"], document["email"])
+        imported += len(inserted)
+    
+    failures.sort(key=lambda failure: failure["row"])
+    return {
+        "total": len(rows),
+        "imported": imported,
+        "failed": len(failures),
+        "failures": failures
+    }
+
+@api_router.get("/admin/metrics", dependencies=[Depends(get_admin_claims)])
+async def get_admin_metrics():
+    """Runtime metrics of the worker pools"""
+    return {
+        "password_hashing": password_hasher.stats(),
+        "import_password_hashing": import_hasher.stats(),
+        "image_processing": image_processor.stats(),
+        "rendition_cache": rendition_cache.stats(),
+        "activity_tracking": activity_tracker.stats()
+    }
+
+@api_router.get("/admin/stats/activity", dependencies=[Depends(get_admin_claims)])
+async def get_activity_stats():
+    """Daily, weekly and monthly active users from the flushed activity records"""
+    today = local_now().date()
+    first_day = (today - timedelta(days=29)).strftime("%Y-%m-%d")
+    
+    daily, active = await asyncio.gather(
+        db.daily_activity.aggregate([
+            {"$match": {"day": {"$gte": first_day}}},
+            {"$group": {"_id": "$day", "active_users": {"$sum": 1}}},
+            {"$sort": {"_id": 1}}
+        ]).to_list(None),
+        db.daily_activity.aggregate([
+            {"$match": {"day": {"$gte": first_day}}},
+            {"$group": {"_id": "$user_id", "last_day": {"$max": "$day"}}},
+            {"$group": {
+                "_id": None,
+                "mau": {"$sum": 1},
+                "wau": {"$sum": {"$cond": [
+                    {"$gte": ["$last_day", (today - timedelta(days=6)).strftime("%Y-%m-%d")]}, 1, 0
+                ]}}
+            }}
+        ]).to_list(None)
+    )
+    
+    daily_counts = {entry["_id"]: entry["active_users"] for entry in daily}
+    dau = daily_counts.get(today.strftime("%Y-%m-%d"), 0)
+    mau = active[0]["mau"] if active else 0
+    
+    return {
+        "dau": dau,
+        "wau": active[0]["wau"] if active else 0,
+        "mau": mau,
+        "dau_mau_ratio": round(dau / mau, 3) if mau else 0,
+        "daily": [
+            {"day": day, "active_users": daily_counts.get(day, 0)}
+            for day in ((today - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(29, -1, -1))
+        ]
+    }
+
 # === MISSIONS API ===
 
-@api_router.post("/admin/missions")
+@api_router.post("/admin/missions", dependencies=[Depends(get_admin_claims)])
 async def create_mission(
-    mission_request: MissionRequest,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    mission_request: MissionRequest
 ):
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     # Build requirements based on frequency and limits
     requirements = []
     if mission_request.frequency == "daily" and mission_request.daily_limit > 0:
@@ -2088,12 +4113,8 @@ async def create_mission(
     await db.missions.insert_one(mission.dict())
     return {"message": "Missione creata con successo!", "mission_id": mission.id}
 
-@api_router.get("/admin/missions")
-async def get_admin_missions(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+@api_router.get("/admin/missions", dependencies=[Depends(get_admin_claims)])
+async def get_admin_missions():
     missions = await db.missions.find().sort("created_at", -1).to_list(100)
     
     clean_missions = []
@@ -2126,16 +4147,11 @@ async def get_admin_missions(credentials: HTTPAuthorizationCredentials = Depends
 
 # Models moved to top of file
 
-@api_router.put("/admin/missions/{mission_id}")
+@api_router.put("/admin/missions/{mission_id}", dependencies=[Depends(get_admin_claims)])
 async def update_mission(
     mission_id: str,
-    update_request: MissionUpdateRequest,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    update_request: MissionUpdateRequest
 ):
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     # Check if mission exists
     mission = await db.missions.find_one({"id": mission_id})
     if not mission:
@@ -2177,16 +4193,11 @@ async def update_mission(
     await db.missions.update_one({"id": mission_id}, {"$set": update_data})
     return {"message": "Missione aggiornata con successo!"}
 
-@api_router.get("/admin/missions/statistics")
+@api_router.get("/admin/missions/statistics", dependencies=[Depends(get_admin_claims)])
 async def get_mission_statistics(
-    month_year: Optional[str] = None,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    month_year: Optional[str] = None
 ):
     """Get detailed mission statistics for admin dashboard"""
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     if not month_year:
         month_year = get_current_month_year()
     
@@ -2253,15 +4264,9 @@ async def get_mission_statistics(
         "missions": statistics
     }
 
-@api_router.get("/admin/missions/submissions/pending")
-async def get_pending_mission_submissions(
-    credentials: HTTPAuthorizationCredentials = Depends(security)
-):
+@api_router.get("/admin/missions/submissions/pending", dependencies=[Depends(get_admin_claims)])
+async def get_pending_mission_submissions():
     """Get pending mission submissions for admin review"""
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     submissions = await db.mission_submissions.find(
         {"verification_status": "pending"}
     ).sort("submitted_at", -1).to_list(100)
@@ -2281,7 +4286,7 @@ async def get_pending_mission_submissions(
             "mission_id": submission["mission_id"],
             "mission_title": submission["mission_title"],
             "description": submission["description"],
-            "photo_url": submission.get("photo_url"),
+            "photo_url": media_url(submission.get("photo_hash")),
             "submission_url": submission.get("submission_url"),
             "points_earned": submission["points_earned"],
             "submitted_at": submission["submitted_at"].isoformat() if "submitted_at" in submission else None,
@@ -2298,30 +4303,33 @@ async def verify_mission_submission(
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
     """Approve or reject mission submission"""
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
+    current_user = await get_admin_claims(credentials)
     
     if status not in ["approved", "rejected"]:
         raise HTTPException(status_code=400, detail="Status must be 'approved' or 'rejected'")
     
-    # Get submission
-    submission = await db.mission_submissions.find_one({"id": submission_id})
-    if not submission:
-        raise HTTPException(status_code=404, detail="Submission not found")
-    
-    if submission["verification_status"] != "pending":
-        raise HTTPException(status_code=400, detail="Submission already processed")
-    
-    # Update submission status
-    await db.mission_submissions.update_one(
-        {"id": submission_id},
+    # Only a pending submission can be decided, so concurrent admins cannot approve it twice;
+    # approvals also skip months whose leaderboard is already closed
+    pending_filter = {"id": submission_id, "verification_status": "pending"}
+    if status == "approved":
+        pending_filter.update(open_month_filter())
+    submission = await db.mission_submissions.find_one_and_update(
+        pending_filter,
         {"$set": {
             "verification_status": status,
             "verified_at": datetime.utcnow(),
             "verified_by": current_user.id
-        }}
+        }},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
+    if not submission:
+        existing = await db.mission_submissions.find_one({"id": submission_id}, {"_id": 0, "verification_status": 1, "month_year": 1})
+        if not existing:
+            raise HTTPException(status_code=404, detail="Submission not found")
+        if existing["verification_status"] == "pending":
+            raise month_closed_error(existing["month_year"])
+        raise HTTPException(status_code=400, detail="Submission already processed")
     
     if status == "approved":
         # Create user mission record and award points
@@ -2334,12 +4342,9 @@ async def verify_mission_submission(
             submission_id=submission_id
         )
         
-        await db.user_missions.insert_one(user_mission.dict())
-        
-        # Update user points
-        await db.users.update_one(
-            {"id": submission["user_id"]},
-            {"$inc": {"total_points": submission["points_earned"], "current_points": submission["points_earned"]}}
+        await asyncio.gather(
+            db.user_missions.insert_one(user_mission.dict()),
+            award_points(submission["user_id"], submission["points_earned"], submission["month_year"], "mission", submission_id)
         )
         
         # Create success notification
@@ -2371,9 +4376,7 @@ async def create_weekly_quiz(
     questions: List[Dict],
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
+    current_user = await get_admin_claims(credentials)
     
     # Set end date to 7 days from now
     end_date = datetime.utcnow() + timedelta(days=7)
@@ -2389,12 +4392,8 @@ async def create_weekly_quiz(
     await db.weekly_quiz.insert_one(quiz.dict())
     return {"message": "Quiz settimanale creato con successo!", "quiz_id": quiz.id}
 
-@api_router.get("/admin/quiz")
-async def get_admin_quizzes(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+@api_router.get("/admin/quiz", dependencies=[Depends(get_admin_claims)])
+async def get_admin_quizzes():
     quizzes = await db.weekly_quiz.find().sort("quiz_start_date", -1).to_list(50)
     
     clean_quizzes = []
@@ -2415,15 +4414,10 @@ async def get_admin_quizzes(credentials: HTTPAuthorizationCredentials = Depends(
     
     return clean_quizzes
 
-@api_router.put("/admin/quiz/{quiz_id}/close")
+@api_router.put("/admin/quiz/{quiz_id}/close", dependencies=[Depends(get_admin_claims)])
 async def close_quiz(
-    quiz_id: str,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    quiz_id: str
 ):
-    current_user = await get_current_user(credentials)
-    if not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     await db.weekly_quiz.update_one(
         {"id": quiz_id},
         {"$set": {"is_active": False, "quiz_end_date": datetime.utcnow()}}
@@ -2435,7 +4429,7 @@ async def close_quiz(
 
 @api_router.get("/quiz/active")
 async def get_active_quiz(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    current_user = await get_current_user(credentials)
+    current_user = await get_token_claims(credentials)
     
     # Get active quiz
     quiz = await db.weekly_quiz.find_one({
@@ -2475,7 +4469,7 @@ async def submit_quiz(
     answers: List[int],
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    current_user = await get_current_user(credentials)
+    current_user = await get_token_claims(credentials)
     
     quiz = await db.weekly_quiz.find_one({"id": quiz_id})
     if not quiz or not quiz["is_active"]:
@@ -2509,15 +4503,7 @@ async def submit_quiz(
     
     # Award points if perfect score
     if points_earned > 0:
-        await db.users.update_one(
-            {"id": current_user.id},
-            {
-                "$inc": {
-                    "current_points": points_earned,
-                    "total_points": points_earned
-                }
-            }
-        )
+        await award_points(current_user.id, points_earned, get_current_month_year(), "quiz", completion.id)
         
         # Check for badges
         await check_and_award_badges(current_user.id, "quiz_complete")
@@ -2551,12 +4537,16 @@ async def health_check():
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(UploadSizeLimitMiddleware, max_bytes=UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    # Resumable upload clients read where to continue from
+    expose_headers=["Upload-Offset"],
 )
 
 # Configure logging
@@ -2566,6 +4556,78 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    await db.users.create_index("id", unique=True)
+    await db.users.create_index(
+        "token_version", partialFilterExpression={"token_version": {"$gt": 0}}
+    )
+    # Registration and profile updates rely on these to reject duplicates, so without them the
+    # API must not start; existing duplicate data has to be cleaned up first
+    for keys, options in [
+        ("email", {}),
+        ("username", {}),
+        ("club_card_code", {"partialFilterExpression": {"club_card_code": {"$type": "string"}}})
+    ]:
+        try:
+            await db.users.create_index(keys, unique=True, **options)
+        except OperationFailure as e:
+            logger.error(f"Could not create unique index on users.{keys}: {str(e)}")
+            raise RuntimeError(f"users.{keys} has duplicate values; remove them before starting the API") from e
+    await db.points_ledger.create_index("id", unique=True)
+    await db.points_ledger.create_index([("user_id", 1), ("ts", 1)])
+    await db.points_ledger.create_index([("month_year", 1), ("user_id", 1)])
+    await db.monthly_scores.create_index([("month_year", 1), ("user_id", 1)], unique=True)
+    await db.monthly_scores.create_index([("month_year", 1), ("points", -1), ("last_award_at", 1)])
+    await db.daily_scores.create_index([("day", 1), ("user_id", 1)], unique=True)
+    await db.alltime_scores.create_index("user_id", unique=True)
+    await db.alltime_scores.create_index([("points", -1), ("last_award_at", 1)])
+    await db.leaderboard_snapshots.create_index("month_year", unique=True)
+    await db.rank_snapshots.create_index("day", unique=True)
+    await db.daily_activity.create_index([("day", 1), ("user_id", 1)], unique=True)
+    await db.user_stats.create_index("user_id", unique=True)
+    await db.uploads.create_index("expires_at")
+    
+    # Backfill the ledger and its materializations the first time this runs against old data
+    if not await db.points_ledger.find_one({}):
+        await backfill_points_ledger()
+    for collection_name in SCORE_ROLLUPS:
+        if not await db[collection_name].find_one({}):
+            await rebuild_score_rollup(collection_name)
+    
+    await sync_user_stats()
+    await migrate_inline_images()
+    await asyncio.to_thread(rendition_cache.load)
+    await load_leaderboard_ranking(get_current_month_year())
+    await load_identity_filters()
+    await load_token_versions()
+    await load_closed_leaderboard_months()
+
+@app.on_event("startup")
+async def start_rank_snapshots():
+    await load_rank_history()
+    app.state.rank_snapshot_task = asyncio.create_task(run_rank_snapshots())
+
+@app.on_event("startup")
+async def start_leaderboard_closing():
+    app.state.leaderboard_closing_task = asyncio.create_task(run_leaderboard_closing())
+
+@app.on_event("startup")
+async def start_activity_tracking():
+    app.state.activity_flush_task = asyncio.create_task(activity_tracker.run())
+
+@app.on_event("startup")
+async def start_upload_expiry():
+    app.state.upload_expiry_task = asyncio.create_task(run_upload_expiry())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    app.state.activity_flush_task.cancel()
+    try:
+        await activity_tracker.flush()
+    except Exception as e:
+        # Still release the pools and the client below
+        logging.error(f"Failed to flush user activity at shutdown: {str(e)}")
+    image_processor.executor.shutdown(wait=False, cancel_futures=True)
+    import_hasher.executor.shutdown(wait=False, cancel_futures=True)
     client.close()
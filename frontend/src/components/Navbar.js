@@ -2,6 +2,7 @@ import React, { useState } from 'react';
 import { Link, useLocation, useNavigate } from 'react-router-dom';
 import { useAuth } from '@/context/AuthContext';
 import { useLanguage } from '@/context/LanguageContext';
+import { mediaUrl } from '@/lib/utils';
 import { 
   Home, 
   Trophy, 
@@ -79,7 +80,7 @@ const Navbar = () => {
               <div className="flex items-center space-x-2">
                 {user?.avatar_url ? (
                   <img 
-                    src={user.avatar_url} 
+                    src={mediaUrl(user.avatar_url)} 
                     alt={user.name}
                     className="w-8 h-8 avatar-ring object-cover"
                   />
@@ -169,7 +170,7 @@ const Navbar = () => {
                 <div className="flex items-center space-x-3 px-4 py-2">
                   {user?.avatar_url ? (
                     <img 
-                      src={user.avatar_url} 
+                      src={mediaUrl(user.avatar_url)} 
                       alt={user.name}
                       className="w-10 h-10 avatar-ring object-cover"
                     />
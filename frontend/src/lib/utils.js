@@ -4,3 +4,11 @@ import { twMerge } from "tailwind-merge"
 export function cn(...inputs) {
   return twMerge(clsx(inputs));
 }
+
+// Media paths from the API (/api/media/...) live on the backend, not the frontend origin
+export function mediaUrl(path) {
+  if (!path || !path.startsWith("/")) {
+    return path;
+  }
+  return `${process.env.REACT_APP_BACKEND_URL}${path}`;
+}
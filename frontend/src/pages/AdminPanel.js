@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import axios from 'axios';
+import { mediaUrl } from '@/lib/utils';
 import { 
   Users, 
   CheckCircle, 
@@ -569,7 +570,7 @@ const AdminPanel = () => {
         }
       });
       
-      return response.data.image_url;
+      return response.data.image_hash;
     } catch (error) {
       alert('Errore caricamento immagine: ' + (error.response?.data?.detail || 'Errore sconosciuto'));
       return null;
@@ -1437,12 +1438,12 @@ const AdminPanel = () => {
                               onChange={async (e) => {
                                 const file = e.target.files[0];
                                 if (file) {
-                                  const imageUrl = await uploadPrizeImage(file);
-                                  if (imageUrl) {
+                                  const imageHash = await uploadPrizeImage(file);
+                                  if (imageHash) {
                                     updatePrize(prize.position, { 
                                       title: document.getElementById(`prize-title-${prize.position}`).value,
                                       description: document.getElementById(`prize-description-${prize.position}`).value,
-                                      image_url: imageUrl 
+                                      image_hash: imageHash 
                                     });
                                   }
                                 }
@@ -1483,7 +1484,7 @@ const AdminPanel = () => {
                           {prize.image_url && (
                             <div className="mb-3">
                               <img 
-                                src={`data:image/jpeg;base64,${prize.image_url}`}
+                                src={mediaUrl(prize.image_url)}
                                 alt="Prize"
                                 className="w-24 h-18 object-cover rounded border"
                               />
@@ -1873,7 +1874,7 @@ const AdminPanel = () => {
                   <label className="block text-sm font-medium text-gray-700 mb-1">Foto</label>
                   <div className="bg-gray-50 p-3 rounded-lg">
                     <img 
-                      src={`data:image/jpeg;base64,${submissionDetails.photo_url}`}
+                      src={mediaUrl(submissionDetails.photo_url)}
                       alt="Mission submission"
                       className="max-w-full h-auto rounded-lg"
                       style={{maxHeight: '300px'}}
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { useAuth } from '@/context/AuthContext';
 import { t } from '@/utils/translations';
 import axios from 'axios';
+import { mediaUrl } from '@/lib/utils';
 import { 
   Trophy, 
   Target, 
@@ -19,6 +20,9 @@ import {
   FileText
 } from 'lucide-react';
 
+const UPLOAD_CHUNK_BYTES = 256 * 1024;
+const UPLOAD_MAX_RETRIES = 5;
+
 const Dashboard = () => {
   const { user, updateUser } = useAuth();
   const [activeTab, setActiveTab] = useState('missioni');
@@ -141,7 +145,7 @@ const Dashboard = () => {
         formData.append('submission_url', missionSubmissionForm.submissionUrl);
       }
       if (missionSubmissionForm.photo) {
-        formData.append('photo', missionSubmissionForm.photo);
+        formData.append('upload_id', await uploadPhotoResumable(missionSubmissionForm.photo, token));
       }
       
       const response = await axios.post(`${process.env.REACT_APP_BACKEND_URL}/api/missions/${mission.id}/submit`, formData, {
@@ -163,6 +167,35 @@ const Dashboard = () => {
     }
   };
 
+  // Sends a photo in chunks so a dropped connection only resends what the server is missing
+  const uploadPhotoResumable = async (file, token) => {
+    const api = `${process.env.REACT_APP_BACKEND_URL}/api/uploads`;
+    const headers = { Authorization: `Bearer ${token}` };
+    const { data: upload } = await axios.post(api, { size: file.size }, { headers });
+    
+    let offset = upload.offset;
+    let failures = 0;
+    while (offset < file.size) {
+      try {
+        const response = await axios.patch(`${api}/${upload.upload_id}`, file.slice(offset, offset + UPLOAD_CHUNK_BYTES), {
+          headers: { ...headers, 'Upload-Offset': offset, 'Content-Type': 'application/offset+octet-stream' }
+        });
+        offset = Number(response.headers['upload-offset']);
+        failures = 0;
+      } catch (error) {
+        if (error.response && error.response.status !== 409) throw error;
+        if (++failures > UPLOAD_MAX_RETRIES) throw error;
+        await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+        // Ask the server how much arrived before resuming
+        const { data: status } = await axios.get(`${api}/${upload.upload_id}`, { headers });
+        offset = status.offset;
+      }
+    }
+    
+    await axios.post(`${api}/${upload.upload_id}/finalize`, null, { headers });
+    return upload.upload_id;
+  };
+
   if (loading) {
     return (
       <div className="min-h-screen bg-sand-white flex items-center justify-center">
@@ -389,7 +422,7 @@ const Dashboard = () => {
                       <div className="w-16 h-16 mx-auto mb-2 relative">
                         {data.leaderboard[1].avatar_url ? (
                           <img 
-                            src={data.leaderboard[1].avatar_url} 
+                            src={mediaUrl(data.leaderboard[1].avatar_url)} 
                             alt={data.leaderboard[1].name}
                             className="w-full h-full object-cover rounded-full border-4 border-gray-300"
                           />
@@ -413,7 +446,7 @@ const Dashboard = () => {
                       <div className="w-20 h-20 mx-auto mb-2 relative">
                         {data.leaderboard[0].avatar_url ? (
                           <img 
-                            src={data.leaderboard[0].avatar_url} 
+                            src={mediaUrl(data.leaderboard[0].avatar_url)} 
                             alt={data.leaderboard[0].name}
                             className="w-full h-full object-cover rounded-full border-4 border-yellow-400"
                           />
@@ -438,7 +471,7 @@ const Dashboard = () => {
                       <div className="w-16 h-16 mx-auto mb-2 relative">
                         {data.leaderboard[2].avatar_url ? (
                           <img 
-                            src={data.leaderboard[2].avatar_url} 
+                            src={mediaUrl(data.leaderboard[2].avatar_url)} 
                             alt={data.leaderboard[2].name}
                             className="w-full h-full object-cover rounded-full border-4 border-orange-400"
                           />
@@ -471,7 +504,7 @@ const Dashboard = () => {
                       <div className="text-lg font-bold text-gray-400 w-8">#{index + 1}</div>
                       {user.avatar_url ? (
                         <img 
-                          src={user.avatar_url} 
+                          src={mediaUrl(user.avatar_url)} 
                           alt={user.name}
                           className="w-10 h-10 object-cover rounded-full avatar-ring"
                         />
@@ -1,6 +1,7 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useAuth } from '@/context/AuthContext';
 import axios from 'axios';
+import { mediaUrl } from '@/lib/utils';
 import { Trophy, Medal, Star, Users, Calendar } from 'lucide-react';
 
 const Leaderboard = () => {
@@ -8,11 +9,50 @@ const Leaderboard = () => {
   const [leaderboardData, setLeaderboardData] = useState(null);
   const [loading, setLoading] = useState(true);
   const [selectedMonth, setSelectedMonth] = useState('');
+  // Latest data for the stream handler, which must not fetch from inside a state updater
+  const leaderboardRef = useRef(null);
+
+  useEffect(() => {
+    leaderboardRef.current = leaderboardData;
+  }, [leaderboardData]);
 
   useEffect(() => {
     fetchLeaderboard();
   }, [selectedMonth]);
 
+  useEffect(() => {
+    const currentMonth = new Date().toISOString().slice(0, 7);
+    if (selectedMonth && selectedMonth !== currentMonth) return;
+
+    // Live rank changes for the current month, pushed by the server
+    const source = new EventSource(`${axios.defaults.baseURL}/leaderboard/stream`);
+    source.addEventListener('ranks', (event) => {
+      const diff = JSON.parse(event.data);
+      const current = leaderboardRef.current;
+      if (!current) return;
+      // Someone entered the top 50 whose details we don't have yet: reload instead of patching
+      const shown = new Set(current.leaderboard.map((entry) => entry.user_id));
+      if (diff.changes.some((change) => change.position <= 50 && !shown.has(change.user_id))) {
+        fetchLeaderboard();
+        return;
+      }
+      setLeaderboardData((previous) => {
+        if (!previous) return previous;
+        const entries = new Map(previous.leaderboard.map((entry) => [entry.user_id, entry]));
+        diff.removed.forEach((userId) => entries.delete(userId));
+        diff.changes.forEach((change) => {
+          const entry = entries.get(change.user_id);
+          if (entry) entries.set(change.user_id, { ...entry, position: change.position, points: change.points });
+        });
+        const leaderboard = [...entries.values()].sort((a, b) => a.position - b.position);
+        return { ...previous, leaderboard, total_participants: leaderboard.length };
+      });
+    });
+    source.addEventListener('resync', () => fetchLeaderboard());
+
+    return () => source.close();
+  }, [selectedMonth]);
+
   const fetchLeaderboard = async () => {
     try {
       const params = selectedMonth ? { month_year: selectedMonth } : {};
@@ -143,7 +183,7 @@ const Leaderboard = () => {
                         <div className="w-20 h-20 mx-auto">
                           {leaderboardData.leaderboard[1].avatar_url ? (
                             <img 
-                              src={leaderboardData.leaderboard[1].avatar_url} 
+                              src={mediaUrl(leaderboardData.leaderboard[1].avatar_url)} 
                               alt={leaderboardData.leaderboard[1].name}
                               className="w-full h-full object-cover rounded-full border-4 border-gray-400"
                             />
@@ -174,7 +214,7 @@ const Leaderboard = () => {
                         <div className="w-24 h-24 mx-auto">
                           {leaderboardData.leaderboard[0].avatar_url ? (
                             <img 
-                              src={leaderboardData.leaderboard[0].avatar_url} 
+                              src={mediaUrl(leaderboardData.leaderboard[0].avatar_url)} 
                               alt={leaderboardData.leaderboard[0].name}
                               className="w-full h-full object-cover rounded-full border-4 border-yellow-400 animate-gold-glow"
                             />
@@ -205,7 +245,7 @@ const Leaderboard = () => {
                         <div className="w-20 h-20 mx-auto">
                           {leaderboardData.leaderboard[2].avatar_url ? (
                             <img 
-                              src={leaderboardData.leaderboard[2].avatar_url} 
+                              src={mediaUrl(leaderboardData.leaderboard[2].avatar_url)} 
                               alt={leaderboardData.leaderboard[2].name}
                               className="w-full h-full object-cover rounded-full border-4 border-orange-400"
                             />
@@ -265,7 +305,7 @@ const Leaderboard = () => {
                         <div className="relative">
                           {participant.avatar_url ? (
                             <img 
-                              src={participant.avatar_url} 
+                              src={mediaUrl(participant.avatar_url)} 
                               alt={participant.name}
                               className="w-12 h-12 object-cover rounded-full avatar-ring"
                             />
@@ -3,6 +3,7 @@ import { useAuth } from '@/context/AuthContext';
 import { useLocation, useSearchParams } from 'react-router-dom';
 import { t } from '@/utils/translations';
 import axios from 'axios';
+import { mediaUrl } from '@/lib/utils';
 import ImageCropper from '@/components/ImageCropper';
 import DigitalClubCard from '@/components/DigitalClubCard';
 import PublicProfilePopup from '@/components/PublicProfilePopup';
@@ -279,7 +280,7 @@ Vivi la Puglia autentica con noi!`;
                 <div className="w-32 h-32 mx-auto mb-4 relative">
                   {user?.avatar_url ? (
                     <img 
-                      src={user.avatar_url} 
+                      src={mediaUrl(user.avatar_url)} 
                       alt={user.name}
                       className="w-full h-full object-cover rounded-full avatar-ring"
                     />
@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { useParams } from 'react-router-dom';
 import axios from 'axios';
+import { mediaUrl } from '@/lib/utils';
 import { 
   User, 
   Trophy, 
@@ -88,9 +89,9 @@ const PublicProfile = () => {
         <div className="bg-white rounded-[20px] p-8 shadow-lg border border-matte-gold mb-8">
           <div className="flex items-center space-x-6 mb-6">
             {/* Avatar */}
-            {user_info.avatar ? (
+            {user_info.avatar_url ? (
               <img
-                src={`data:image/jpeg;base64,${user_info.avatar}`}
+                src={mediaUrl(user_info.avatar_url)}
                 alt="Avatar"
                 className="w-24 h-24 rounded-full border-4 border-matte-gold object-cover shadow-lg"
               />
@@ -1,5 +1,6 @@
-import React, { useState } from 'react';
+import React, { useState, useEffect } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
+import axios from 'axios';
 import { useAuth } from '@/context/AuthContext';
 import { Eye, EyeOff, User, Mail, Lock, ArrowLeft } from 'lucide-react';
 
@@ -16,10 +17,35 @@ const Register = () => {
   const [showConfirmPassword, setShowConfirmPassword] = useState(false);
   const [error, setError] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  const [taken, setTaken] = useState({ username: false, email: false });
   
   const { register } = useAuth();
   const navigate = useNavigate();
 
+  // Live "already taken" check, debounced while the user types
+  useEffect(() => {
+    const params = {};
+    if (formData.username.length >= 3) params.username = formData.username;
+    if (/^[^\s@]+@[^\s@]+\.[^\s@]+$/.test(formData.email)) params.email = formData.email;
+    if (!params.username && !params.email) {
+      setTaken({ username: false, email: false });
+      return;
+    }
+
+    const timer = setTimeout(async () => {
+      try {
+        const response = await axios.get('/auth/availability', { params });
+        setTaken({
+          username: response.data.username ? !response.data.username.available : false,
+          email: response.data.email ? !response.data.email.available : false
+        });
+      } catch (err) {
+        // The submit still reports duplicates, so a failed check is not an error
+      }
+    }, 300);
+    return () => clearTimeout(timer);
+  }, [formData.username, formData.email]);
+
   const countries = [
     { code: 'IT', name: 'Italia' },
     { code: 'US', name: 'Stati Uniti' },
@@ -155,7 +181,11 @@ const Register = () => {
                   placeholder="Il tuo username unico"
                 />
               </div>
-              <p className="text-xs text-gray-500 mt-1">Almeno 3 caratteri, sarà visibile agli altri utenti</p>
+              {taken.username ? (
+                <p className="text-xs text-red-600 mt-1">Username già in uso</p>
+              ) : (
+                <p className="text-xs text-gray-500 mt-1">Almeno 3 caratteri, sarà visibile agli altri utenti</p>
+              )}
             </div>
 
             {/* Email */}
@@ -176,6 +206,9 @@ const Register = () => {
                   placeholder="La tua email"
                 />
               </div>
+              {taken.email && (
+                <p className="text-xs text-red-600 mt-1">Email già registrata</p>
+              )}
             </div>
 
             {/* Country */}
@@ -0,0 +1,9 @@
+import os
+import sys
+from pathlib import Path
+
+# The backend modules import each other as top-level scripts. Motor connects lazily,
+# so importing server.py needs these settings but no running database.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
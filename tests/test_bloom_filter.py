@@ -0,0 +1,19 @@
+import random
+
+from server import BloomFilter
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(5000)
+    keys = [f"user{n}@example.com" for n in range(5000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+
+def test_bloom_filter_false_positive_rate_is_bounded():
+    rng = random.Random(3)
+    bloom = BloomFilter(10000, error_rate=0.01)
+    for n in range(10000):
+        bloom.add(f"member-{n}")
+    probes = [f"stranger-{rng.random()}" for _ in range(20000)]
+    false_positives = sum(probe in bloom for probe in probes)
+    assert false_positives / len(probes) < 0.02
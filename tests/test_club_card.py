@@ -0,0 +1,16 @@
+from server import format_club_card_code
+
+def test_club_card_codes_are_unique_within_the_first_block():
+    codes = [format_club_card_code(sequence) for sequence in range(90000)]
+    assert len(set(codes)) == len(codes)
+    assert all(10000 <= int(code[3:]) <= 99999 for code in codes)
+
+def test_club_card_codes_widen_after_the_first_block():
+    assert len(format_club_card_code(89999)) == len("DP-12345")
+    assert len(format_club_card_code(90000)) == len("DP-123456")
+    sixth_digit_block = {format_club_card_code(sequence) for sequence in range(90000, 100000)}
+    assert len(sixth_digit_block) == 10000
+
+def test_consecutive_club_card_codes_are_scrambled():
+    first, second = format_club_card_code(0), format_club_card_code(1)
+    assert abs(int(second[3:]) - int(first[3:])) > 1
@@ -0,0 +1,68 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from imaging import WEBP_SUPPORTED, ImageTooLarge, InvalidImage, probe_image, process_image, render_renditions
+
+def encode(image: Image.Image, image_format: str = "JPEG", **params) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **params)
+    return buffer.getvalue()
+
+def decode(data: bytes) -> Image.Image:
+    image = Image.open(BytesIO(data))
+    image.load()
+    return image
+
+def test_process_image_crops_to_exact_size():
+    data = encode(Image.new("RGB", (1200, 800), "red"))
+    result = decode(process_image(data, (400, 400), crop=True))
+    assert result.format == "JPEG"
+    assert result.size == (400, 400)
+
+def test_process_image_keeps_aspect_and_never_enlarges():
+    wide = decode(process_image(encode(Image.new("RGB", (1600, 800))), (800, 600)))
+    assert wide.size == (800, 400)
+    small = decode(process_image(encode(Image.new("RGB", (200, 100))), (800, 600)))
+    assert small.size == (200, 100)
+
+def test_process_image_applies_exif_rotation():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated 90 degrees clockwise
+    data = encode(Image.new("RGB", (800, 400)), exif=exif)
+    assert decode(process_image(data, (1000, 1000))).size == (400, 800)
+
+def test_process_image_flattens_transparency_onto_white():
+    data = encode(Image.new("RGBA", (50, 50), (0, 0, 0, 0)), "PNG")
+    result = decode(process_image(data, (100, 100)))
+    assert result.mode == "RGB"
+    assert all(channel > 245 for channel in result.getpixel((25, 25)))
+
+def test_process_image_rejects_garbage():
+    with pytest.raises(InvalidImage):
+        process_image(b"not an image", (100, 100))
+
+def test_render_renditions_from_one_decode():
+    data = encode(Image.new("RGB", (1000, 500)))
+    renditions = render_renditions(data, [96, 400, 1600])
+    assert decode(renditions[96]).size == (96, 48)
+    assert decode(renditions[400]).size == (400, 200)
+    # Wider than the source: served at the source size rather than enlarged
+    assert decode(renditions[1600]).size == (1000, 500)
+
+@pytest.mark.skipif(not WEBP_SUPPORTED, reason="Pillow built without WebP")
+def test_render_renditions_as_webp():
+    renditions = render_renditions(encode(Image.new("RGB", (300, 300))), [96], "WEBP")
+    assert decode(renditions[96]).format == "WEBP"
+
+def test_probe_image_reads_the_header_and_rewinds():
+    upload = BytesIO(encode(Image.new("RGB", (640, 480)), "PNG"))
+    assert probe_image(upload, 1_000_000) == ("PNG", (640, 480))
+    assert upload.tell() == 0
+
+def test_probe_image_limits_pixels_and_formats():
+    with pytest.raises(ImageTooLarge):
+        probe_image(BytesIO(encode(Image.new("1", (3000, 3000)), "PNG")), 1_000_000)
+    with pytest.raises(InvalidImage):
+        probe_image(BytesIO(encode(Image.new("RGB", (10, 10)), "BMP")), 1_000_000)
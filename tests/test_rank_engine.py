@@ -0,0 +1,130 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from server import LeaderboardRanking, RankHistory, RankIndex, get_current_month_year, local_now
+
+def assert_matches(index: RankIndex, expected: list):
+    assert len(index) == len(expected)
+    assert index.slice(0, len(expected)) == expected
+    for position, key in enumerate(expected, 1):
+        assert index.rank(key) == position
+
+def test_rank_index_matches_sorted_list():
+    rng = random.Random(7)
+    index = RankIndex()
+    expected = []
+    for _ in range(600):
+        if expected and rng.random() < 0.4:
+            key = rng.choice(expected)
+            index.remove(key)
+            expected.remove(key)
+        else:
+            key = (rng.randint(-50, 0), rng.random())
+            index.insert(key)
+            expected.append(key)
+            expected.sort()
+        assert_matches(index, expected)
+        start = rng.randint(-2, len(expected) + 2)
+        stop = rng.randint(max(start, 0), len(expected) + 3)
+        assert index.slice(start, stop) == expected[max(start, 0):stop]
+
+def test_rank_index_missing_keys():
+    index = RankIndex()
+    index.insert((1, "a"))
+    assert index.rank((2, "b")) == 0
+    with pytest.raises(KeyError):
+        index.remove((2, "b"))
+    assert index.slice(1, 5) == []
+
+def brute_force_top(scores: dict, attributes: dict, country=None, level=None) -> list:
+    """User ids in rank order, filtered the way a ranking partition is"""
+    user_ids = [
+        user_id for user_id in scores
+        if (not country or attributes[user_id][0] == country) and (not level or attributes[user_id][1] == level)
+    ]
+    return sorted(user_ids, key=lambda user_id: (-scores[user_id][0], scores[user_id][1], user_id))
+
+def test_leaderboard_ranking_partitions_follow_updates():
+    rng = random.Random(11)
+    ranking = LeaderboardRanking()
+    ranking.reset("2025-01")
+    countries, levels = ["IT", "DE", ""], ["Explorer", "Local Lover"]
+    started = datetime(2025, 1, 1)
+    scores, attributes = {}, {}
+    
+    for step in range(400):
+        user_id = f"user-{rng.randint(0, 60)}"
+        if user_id in scores and rng.random() < 0.3:
+            country, level = rng.choice(countries), rng.choice(levels)
+            ranking.set_attributes(user_id, country=country, level=level)
+            attributes[user_id] = (country, level)
+        else:
+            points = scores.get(user_id, (0, None))[0] + rng.randint(1, 20)
+            awarded_at = started + timedelta(minutes=step)
+            country, level = attributes.get(user_id, (rng.choice(countries), rng.choice(levels)))
+            ranking.update(user_id, points, awarded_at, country, level)
+            scores[user_id] = (points, awarded_at)
+            attributes[user_id] = (country, level)
+    
+    views = [(None, None)] + [(c, None) for c in countries if c] + [(None, l) for l in levels]
+    views += [(c, l) for c in countries if c for l in levels]
+    for country, level in views:
+        partition = ranking.partition_key(country=country, level=level)
+        expected = brute_force_top(scores, attributes, country, level)
+        assert [entry["user_id"] for entry in ranking.top(len(scores) + 1, partition)] == expected
+        for position, user_id in enumerate(expected, 1):
+            assert ranking.rank(user_id, partition) == position
+    
+    leader = brute_force_top(scores, attributes)[0]
+    assert ranking.points(leader) == scores[leader][0]
+    assert ranking.points("nobody") == 0
+
+def test_leaderboard_ranking_ignores_stale_scores():
+    ranking = LeaderboardRanking()
+    ranking.reset("2025-01")
+    ranking.update("a", 30, datetime(2025, 1, 2), "IT", "Explorer")
+    ranking.update("b", 20, datetime(2025, 1, 1), "IT", "Explorer")
+    # An award that finished after a later one reports a lower total
+    ranking.update("a", 10, datetime(2025, 1, 1), "IT", "Explorer")
+    
+    assert ranking.points("a") == 30
+    assert [entry["user_id"] for entry in ranking.top(2)] == ["a", "b"]
+    assert [entry["user_id"] for entry in ranking.top(2, ranking.partition_key(country="IT"))] == ["a", "b"]
+
+def test_leaderboard_ranking_around():
+    ranking = LeaderboardRanking()
+    ranking.reset("2025-01")
+    for points in range(10):
+        ranking.update(f"user-{points}", points, datetime(2025, 1, 1), "IT", "Explorer")
+    
+    assert [entry["position"] for entry in ranking.around("user-5", 2)] == [3, 4, 5, 6, 7]
+    assert [entry["user_id"] for entry in ranking.around("user-9", 1)] == ["user-9", "user-8"]
+    assert ranking.around("nobody", 2) == []
+
+def test_rank_history_positions_and_delta():
+    history = RankHistory(max_days=3)
+    today = local_now().date()
+    days = [(today - timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(5, 0, -1)]
+    for day in days:
+        history.add(day, get_current_month_year(), ["a", "b", "c"])
+    yesterday = days[-1]
+    history.add(yesterday, get_current_month_year(), ["c", "a", "b"])
+    
+    assert list(history.days) == days[-3:]
+    assert history.position(yesterday, "c") == 1
+    assert history.position(yesterday, "b") == 3
+    assert history.position(yesterday, "unknown") is None
+    assert history.position(days[0], "a") is None
+    
+    # Moving from 3rd to 1st is two places gained; users missing yesterday have no delta
+    assert history.delta("b", 1) == 2
+    assert history.delta("c", 2) == -1
+    assert history.delta("d", 1) is None
+
+def test_rank_history_delta_only_within_a_month():
+    history = RankHistory()
+    yesterday = (local_now().date() - timedelta(days=1)).strftime("%Y-%m-%d")
+    history.add(yesterday, "1999-12", ["a"])
+    assert history.delta("a", 1) is None